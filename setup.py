@@ -16,6 +16,7 @@ setuptools.setup(
     url="https://github.com/PaulAnnekov/tuyaha",
     license="MIT",
     install_requires=["requests"],
+    extras_require={"speedups": ["numpy", "orjson"], "async": ["aiohttp"]},
     classifiers=(
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
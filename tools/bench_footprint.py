@@ -0,0 +1,284 @@
+# The script measures the startup and memory footprint of the library:
+# cold import time of tuyaha.tuyaapi, RSS per device and tracemalloc
+# allocations of a discovery at several fleet sizes, using replayed
+# responses. Every measure runs in a fresh interpreter. Import time is the
+# fastest of several runs, measured after the import of requests (the
+# reference, reported but not compared) so only the library is timed. RSS
+# is the median of several runs. Results can be saved as a baseline and compared with
+# it, the script exits with 1 when a metric regresses more than the
+# tolerance.
+#
+#   python tools/bench_footprint.py --save tools/footprint_baseline.json
+#   python tools/bench_footprint.py --compare tools/footprint_baseline.json
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+DEF_BASELINE = os.path.join(os.path.dirname(__file__), "footprint_baseline.json")
+# RSS is counted in pages, per device values are noisy below 1000 devices
+DEF_SIZES = (1000, 2000, 5000)
+DEF_IMPORT_RUNS = 10
+DEF_RSS_RUNS = 5
+
+# allowed increase over baseline, in percent, by kind of metric
+TOLERANCE = {"time": 25.0, "rss": 15.0, "alloc": 10.0, "count": 0.0}
+# RSS grows by pages and whole malloc arenas, a smaller change of the
+# total is not reported whatever the percentage
+MIN_RSS_DELTA = 1024 * 1024
+# the library imports in about 10 ms, a smaller change than this one is
+# noise whatever the percentage
+MIN_TIME_DELTA_MS = 5.0
+
+IMPORT_CODE = """
+import sys, time
+start = time.perf_counter()
+import requests
+reference = time.perf_counter() - start
+before = set(sys.modules)
+start = time.perf_counter()
+import tuyaha.tuyaapi
+elapsed = time.perf_counter() - start
+print(reference, elapsed, len(set(sys.modules) - before))
+"""
+
+
+def _rss():
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        # peak instead of current RSS, in KiB on Linux and bytes on macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def worker_rss(size):
+    from tuyaha.transport import TuyaReplaySession, synthetic_recording
+    from tuyaha.tuyaapi import TuyaApi
+
+    session = TuyaReplaySession(synthetic_recording(size))
+    api = TuyaApi()
+    before = _rss()
+    api.init("bench", "bench", "1", session=session)
+    discovered = _rss()
+    # every device object created, as when all devices are used
+    len(list(api.get_all_devices()))
+    created = _rss()
+    return {
+        "rss_discovery_per_device": (discovered - before) / size,
+        "rss_created_per_device": (created - before) / size,
+    }
+
+
+def worker_alloc(size):
+    import tracemalloc
+
+    from tuyaha.transport import TuyaReplaySession, synthetic_recording
+    from tuyaha.tuyaapi import TuyaApi
+
+    session = TuyaReplaySession(synthetic_recording(size))
+    api = TuyaApi()
+    tracemalloc.start()
+    api.init("bench", "bench", "1", session=session)
+    discovery_current, discovery_peak = tracemalloc.get_traced_memory()
+    len(list(api.get_all_devices()))
+    created_current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "alloc_discovery_kib": discovery_current / 1024,
+        "alloc_discovery_peak_kib": discovery_peak / 1024,
+        "alloc_created_kib": created_current / 1024,
+    }
+
+
+WORKERS = {"rss": worker_rss, "alloc": worker_alloc}
+
+
+def _run_worker(kind, size):
+    output = subprocess.check_output(
+        [sys.executable, __file__, "--worker", kind, str(size)],
+        env=_env(),
+    )
+    return json.loads(output)
+
+
+def _env():
+    # the checked out library is measured, not an installed one
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        path for path in (root, env.get("PYTHONPATH")) if path
+    )
+    return env
+
+
+def measure_import(runs):
+    # other processes only slow down an import, the fastest run is the
+    # most stable value
+    references = []
+    times = []
+    modules = None
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, "-c", IMPORT_CODE], env=_env()
+        )
+        reference, elapsed, modules = output.split()
+        references.append(float(reference))
+        times.append(float(elapsed))
+    return {
+        "import_reference_ms": min(references) * 1000,
+        "import_time_ms": min(times) * 1000,
+        "import_modules": int(modules),
+    }
+
+
+def measure_rss(size, runs):
+    samples = [_run_worker("rss", size) for _ in range(runs)]
+    return {
+        metric: statistics.median(sample[metric] for sample in samples)
+        for metric in samples[0]
+    }
+
+
+def measure(sizes, import_runs, rss_runs):
+    results = {"import": measure_import(import_runs)}
+    for size in sizes:
+        values = measure_rss(size, rss_runs)
+        values.update(_run_worker("alloc", size))
+        results["devices_{}".format(size)] = values
+    return results
+
+
+def _kind(metric):
+    if metric.endswith("_reference_ms"):
+        return "reference"
+    if metric.endswith("_ms"):
+        return "time"
+    if metric.endswith("_modules"):
+        return "count"
+    if metric.startswith("rss_"):
+        return "rss"
+    return "alloc"
+
+
+def _size(group):
+    # rss metrics are per device, groups are named devices_<size>
+    return int(group.rpartition("_")[2])
+
+
+def _significant(kind, group, delta):
+    # small absolute changes are noise even when the percentage is high
+    if kind == "rss":
+        return delta * _size(group) >= MIN_RSS_DELTA
+    if kind == "time":
+        return delta >= MIN_TIME_DELTA_MS
+    return True
+
+
+def compare(baseline, results, scale):
+    """Print current values against baseline, return the regressed metrics"""
+    regressions = []
+    print(
+        "{:40s} {:>12s} {:>12s} {:>8s}".format(
+            "metric", "baseline", "current", "change"
+        )
+    )
+    for group, values in results.items():
+        for metric, value in values.items():
+            name = "{}.{}".format(group, metric)
+            base = baseline.get(group, {}).get(metric)
+            if base is None:
+                print("{:40s} {:>12s} {:12.1f}".format(name, "-", value))
+                continue
+            change = (value - base) / base * 100 if base else 0.0
+            kind = _kind(metric)
+            status = ""
+            if (
+                kind in TOLERANCE
+                and change > TOLERANCE[kind] * scale
+                and _significant(kind, group, value - base)
+            ):
+                status = "REGRESSION"
+                regressions.append(name)
+            print(
+                "{:40s} {:12.1f} {:12.1f} {:+7.1f}% {}".format(
+                    name, base, value, change, status
+                )
+            )
+    return regressions
+
+
+def _environment():
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": sys.platform,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="tuyaha footprint benchmark")
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=list(DEF_SIZES),
+        help="comma separated fleet sizes",
+    )
+    parser.add_argument("--import-runs", type=int, default=DEF_IMPORT_RUNS)
+    parser.add_argument("--rss-runs", type=int, default=DEF_RSS_RUNS)
+    parser.add_argument("--save", metavar="FILE", help="save results as baseline")
+    parser.add_argument(
+        "--compare",
+        metavar="FILE",
+        nargs="?",
+        const=DEF_BASELINE,
+        help="compare with baseline, exit with 1 on regression",
+    )
+    parser.add_argument(
+        "--tolerance-scale",
+        type=float,
+        default=1.0,
+        help="multiply the allowed regression of every metric",
+    )
+    parser.add_argument("--worker", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        kind, size = args.worker
+        print(json.dumps(WORKERS[kind](int(size))))
+        return 0
+
+    results = measure(args.sizes, args.import_runs, args.rss_runs)
+    if args.save:
+        with open(args.save, "w") as fh:
+            json.dump(
+                {"environment": _environment(), "results": results}, fh, indent=1
+            )
+        print("baseline saved to {}".format(args.save))
+    if not args.compare:
+        print(json.dumps(results, indent=1))
+        return 0
+
+    with open(args.compare) as fh:
+        baseline = json.load(fh)
+    if baseline.get("environment") != _environment():
+        print(
+            "warning: baseline measured on {}, not comparable".format(
+                baseline.get("environment")
+            )
+        )
+    regressions = compare(baseline["results"], results, args.tolerance_scale)
+    if regressions:
+        print("regressions: {}".format(", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
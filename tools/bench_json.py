@@ -0,0 +1,76 @@
+# The script compares the CPU time spent by the available JSON codecs to
+# build skill requests and to parse discovery responses.
+#
+#   python tools/bench_json.py
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuyaha.codec import (  # noqa: E402
+    TuyaJsonCodec,
+    TuyaOrjsonCodec,
+    build_request,
+    orjson,
+)
+
+DEVICES = 200
+REPEAT = 2000
+
+
+def discovery_response(count):
+    devices = []
+    for i in range(count):
+        devices.append(
+            {
+                "id": "bf{:020d}".format(i),
+                "name": "Device {}".format(i),
+                "dev_type": "light",
+                "ha_type": "light",
+                "icon": "https://images.tuyaeu.com/smart/icon/{}.png".format(i),
+                "data": {
+                    "online": True,
+                    "state": "true",
+                    "brightness": "255",
+                    "color_mode": "colour",
+                    "color": {"hue": 120, "saturation": 0.5, "brightness": 200},
+                    "color_temp": 5000,
+                },
+            }
+        )
+    return {"header": {"code": "SUCCESS"}, "payload": {"devices": devices}}
+
+
+def legacy_request():
+    header = {"name": "brightnessSet", "namespace": "control", "payloadVersion": 1}
+    payload = {"value": 50.0, "accessToken": "EU1234567890", "devId": "bf1234"}
+    return json.dumps({"header": header, "payload": payload}).encode()
+
+
+def main():
+    response = json.dumps(discovery_response(DEVICES)).encode()
+    payload = {"value": 50.0, "accessToken": "EU1234567890", "devId": "bf1234"}
+
+    print("request build, {} calls".format(REPEAT * 10))
+    elapsed = timeit.timeit(legacy_request, number=REPEAT * 10)
+    print("  {:8s} {:.1f} ms".format("legacy", elapsed * 1000))
+    codecs = [TuyaJsonCodec()]
+    if orjson is not None:
+        codecs.append(TuyaOrjsonCodec())
+    for codec in codecs:
+        elapsed = timeit.timeit(
+            lambda: build_request(codec, "brightnessSet", "control", payload),
+            number=REPEAT * 10,
+        )
+        print("  {:8s} {:.1f} ms".format(codec.name, elapsed * 1000))
+
+    print("discovery parse, {} devices, {} calls".format(DEVICES, REPEAT // 10))
+    for codec in codecs:
+        elapsed = timeit.timeit(lambda: codec.loads(response), number=REPEAT // 10)
+        print("  {:8s} {:.1f} ms".format(codec.name, elapsed * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# The script compares the time spent by state_snapshot, with and without
+# NumPy, with the time spent creating the device objects and calling the
+# per device methods returning the same columns, for a fleet of replayed
+# devices. The snapshot must not create any device object.
+#
+#   python tools/bench_snapshot.py --devices 50000
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuyaha.snapshot import _load_numpy  # noqa: E402
+from tuyaha.transport import TuyaReplaySession, synthetic_recording  # noqa: E402
+from tuyaha.tuyaapi import TuyaApi  # noqa: E402
+
+DEVICES = 50000
+REPEAT = 5
+
+
+def per_device(devices):
+    for device in devices:
+        device.state()
+        device.available()
+        dev_type = device.device_type()
+        if dev_type == "light":
+            device.brightness()
+            device.color_temp()
+            device.hs_color()
+        elif dev_type == "climate":
+            device.current_temperature()
+            device.target_temperature()
+
+
+def best_time(func, *args):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="state_snapshot benchmark")
+    parser.add_argument("--devices", type=int, default=DEVICES)
+    args = parser.parse_args(argv)
+
+    api = TuyaApi()
+    session = TuyaReplaySession(synthetic_recording(args.devices))
+    api.init("bench", "bench", "1", session=session)
+    print("devices: {}, best of {} runs".format(args.devices, REPEAT))
+
+    modes = [False]
+    if _load_numpy() is not None:
+        modes.append(True)
+    for use_numpy in modes:
+        elapsed = best_time(api.state_snapshot, None, use_numpy)
+        name = "numpy" if use_numpy else "python"
+        print("  snapshot {:16s} {:8.1f} ms".format(name, elapsed * 1000))
+    created = len(api._devices.created())
+    print("  objects created by snapshot: {}".format(created))
+
+    start = time.perf_counter()
+    devices = list(api.get_all_devices())
+    elapsed = time.perf_counter() - start
+    print("  object creation          {:8.1f} ms".format(elapsed * 1000))
+    elapsed = best_time(per_device, devices)
+    print("  per device methods       {:8.1f} ms".format(elapsed * 1000))
+    return 0 if created == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+# The script checks the TuyaApi concurrency contract: it runs discovery,
+# token refresh, device control and device update from many threads
+# against an in-memory fake cloud, then verifies that no thread failed
+# and that no update was lost.
+#
+#   python tools/stress_api.py --duration 10
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+from json import loads as json_loads
+from urllib.parse import urlparse
+
+# the checked out library is tested, not an installed one
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuyaha import tuyaapi  # noqa: E402
+from tuyaha.transport import TuyaReplayResponse  # noqa: E402
+from tuyaha.tuyaapi import REFRESHTIME, SESSION, TuyaApi  # noqa: E402
+
+
+class FakeCloudSession:
+    """Stateful fake of the Tuya cloud, thread safe, with random latency"""
+
+    def __init__(self, count, latency, token_life):
+        self._lock = threading.Lock()
+        self._latency = latency
+        self._token_life = token_life
+        self._token_id = 0
+        self.devices = {}
+        self.refreshing = 0
+        self.violations = []
+        for i in range(count):
+            dev_id = "stress{:04d}".format(i)
+            self.devices[dev_id] = {
+                "id": dev_id,
+                "name": "light {}".format(i),
+                "dev_type": "light",
+                "ha_type": "light",
+                "icon": "",
+                "data": {"online": True, "state": "false", "brightness": "100"},
+            }
+
+    def _sleep(self):
+        if self._latency:
+            time.sleep(random.uniform(0, self._latency))
+
+    def _token(self):
+        self._token_id += 1
+        return {
+            "access_token": "EUstress{}".format(self._token_id),
+            "refresh_token": "EUstress{}".format(self._token_id),
+            "expires_in": REFRESHTIME + self._token_life,
+        }
+
+    def get(self, url, **kwargs):
+        # token refresh, must never run concurrently
+        with self._lock:
+            self.refreshing += 1
+            if self.refreshing > 1:
+                self.violations.append("concurrent token refresh")
+        self._sleep()
+        with self._lock:
+            self.refreshing -= 1
+            return TuyaReplayResponse(self._token())
+
+    def post(self, url, data=None, json=None, **kwargs):
+        self._sleep()
+        if urlparse(url).path.endswith("auth.do"):
+            with self._lock:
+                return TuyaReplayResponse(self._token())
+        request = json_loads(data)
+        name = request["header"]["name"]
+        dev_id = request["payload"].get("devId")
+        with self._lock:
+            if name == "Discovery":
+                body = {"devices": list(self.devices.values())}
+            elif name == "QueryDevice":
+                body = {"data": self.devices[dev_id]["data"]}
+            elif name == "turnOnOff":
+                value = request["payload"]["value"]
+                self.devices[dev_id]["data"]["state"] = (
+                    "true" if value == "1" else "false"
+                )
+                body = {}
+            else:
+                body = {}
+            # serialized under lock, so concurrent commands do not change it
+            response = TuyaReplayResponse(
+                {"header": {"code": "SUCCESS"}, "payload": body}
+            )
+        self._sleep()
+        return response
+
+    def state(self, dev_id):
+        with self._lock:
+            return self.devices[dev_id]["data"]["state"] == "true"
+
+
+# seconds waited for all the threads once the test is over, a thread still
+# running is deadlocked
+JOIN_TIMEOUT = 10.0
+
+
+def run(args):
+    random.seed(args.seed)
+    cloud = FakeCloudSession(args.devices, args.latency, args.token_life)
+    api = TuyaApi()
+    api.discovery_interval = tuyaapi.MIN_DISCOVERY_INTERVAL
+    api.query_interval = tuyaapi.MIN_QUERY_INTERVAL
+    api.init("stress", "stress", "1", session=cloud)
+    dev_ids = list(cloud.devices)
+
+    errors = []
+    stop = threading.Event()
+    counters = {"discovery": 0, "control": 0, "update": 0}
+    counter_lock = threading.Lock()
+
+    def count(name):
+        with counter_lock:
+            counters[name] += 1
+
+    def worker(func):
+        try:
+            while not stop.is_set():
+                func()
+        except Exception:
+            errors.append(traceback.format_exc())
+            stop.set()
+
+    def discover():
+        api._force_discovery = True
+        api.poll_devices_update()
+        count("discovery")
+
+    # the order of conflicting commands sent to the same device at the
+    # same time is not defined, so commands are serialized by device
+    control_locks = {dev_id: threading.Lock() for dev_id in dev_ids}
+
+    def control():
+        dev_id = random.choice(dev_ids)
+        with control_locks[dev_id]:
+            device = api.get_device_by_id(dev_id)
+            if random.random() < 0.5:
+                device.turn_on()
+            else:
+                device.turn_off()
+        count("control")
+
+    # device updated by the current thread, see listener
+    local = threading.local()
+
+    def update():
+        device = api.get_device_by_id(random.choice(dev_ids))
+        device._last_query = device._last_query.min
+        local.device = device
+        try:
+            device.update(use_discovery=random.random() < 0.5)
+        finally:
+            local.device = None
+        count("update")
+
+    def listener(dev_id):
+        # listeners are called without any library lock held, so updating
+        # again the device that notified must not deadlock
+        device = getattr(local, "device", None)
+        if device is None or getattr(local, "nested", False):
+            return
+        local.nested = True
+        try:
+            device.update(use_discovery=False)
+        finally:
+            local.nested = False
+
+    api.add_state_listener(listener)
+
+    def check_consistency():
+        # cache, device list and id index must describe the same devices
+        devices = api.get_all_devices()
+        ids = {device.object_id() for device in devices}
+        cached = {device["id"] for device in api._discovered_devices}
+        if ids != cached or ids != set(dev_ids):
+            errors.append("device list and discovery cache differ")
+        for dev_id in dev_ids:
+            if api.get_device_by_id(dev_id) is None:
+                errors.append("device {} missing from index".format(dev_id))
+
+    threads = []
+    for func, number in (
+        (discover, args.discovery_threads),
+        (control, args.control_threads),
+        (update, args.update_threads),
+        (check_consistency, 1),
+    ):
+        for _ in range(number):
+            threads.append(
+                threading.Thread(target=worker, args=(func,), daemon=True)
+            )
+    for thread in threads:
+        thread.start()
+    stop.wait(args.duration)
+    stop.set()
+    deadline = time.monotonic() + JOIN_TIMEOUT
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    stuck = sum(1 for thread in threads if thread.is_alive())
+    if stuck:
+        print("deadlock: {} threads still running".format(stuck))
+        return False
+
+    # no thread is running now: the cached state must match the cloud,
+    # i.e. no optimistic update has been lost
+    lost = [
+        dev_id
+        for dev_id in dev_ids
+        if api.get_device_by_id(dev_id).state() != cloud.state(dev_id)
+    ]
+
+    print("operations: {}".format(counters))
+    print("token refreshes: {}".format(cloud._token_id))
+    print("errors: {}".format(len(errors)))
+    for error in errors[:5]:
+        print(error)
+    print("contract violations: {}".format(cloud.violations[:5]))
+    print("lost updates: {} {}".format(len(lost), lost[:10]))
+    SESSION.devices = []
+    return not errors and not cloud.violations and not lost
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TuyaApi thread-safety stress test")
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--discovery-threads", type=int, default=4)
+    parser.add_argument("--control-threads", type=int, default=24)
+    parser.add_argument("--update-threads", type=int, default=8)
+    parser.add_argument(
+        "--latency", type=float, default=0.002, help="max fake cloud latency (s)"
+    )
+    parser.add_argument(
+        "--token-life",
+        type=float,
+        default=0.5,
+        help="seconds before the token must be refreshed",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    return 0 if run(args) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
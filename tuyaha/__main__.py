@@ -0,0 +1,3 @@
+from tuyaha.cli import main
+
+main()
@@ -0,0 +1,366 @@
+"""Command line tools to inspect and profile the Tuya Home Assistant API.
+
+Credentials are read from a JSON file passed with --credentials (keys
+username, password, country_code, biz_type, region) or from the
+TUYA_USERNAME, TUYA_PASSWORD, TUYA_COUNTRY_CODE, TUYA_BIZ_TYPE and
+TUYA_REGION environment variables. They are not needed with
+--transport replay.
+"""
+import argparse
+import cProfile
+import json
+import os
+import pprint
+import pstats
+import sys
+import time
+import tracemalloc
+
+from tuyaha.codec import TuyaJsonCodec
+from tuyaha.tracing import TuyaTraceHooks
+from tuyaha.transport import (
+    TuyaRecordingSession,
+    TuyaReplaySession,
+    synthetic_recording,
+)
+from tuyaha.tuyaapi import DEFAULTREGION, TuyaApi, TuyaFrequentlyInvokeException
+
+ENV_PREFIX = "TUYA_"
+CREDENTIAL_KEYS = ("username", "password", "country_code", "biz_type", "region")
+DEF_REPLAY_DEVICES = 100
+
+
+class _TimingCodec(TuyaJsonCodec):
+    """Wrap a codec to measure the time spent decoding responses"""
+
+    def __init__(self, codec):
+        self._codec = codec
+        self.name = codec.name
+        self.decode_time = 0.0
+
+    def dumps(self, obj):
+        return self._codec.dumps(obj)
+
+    def loads(self, data):
+        start = time.perf_counter()
+        try:
+            return self._codec.loads(data)
+        finally:
+            self.decode_time += time.perf_counter() - start
+
+
+class _TimingHooks(TuyaTraceHooks):
+    """Collect the duration of every request, and of its decoding, by action"""
+
+    def __init__(self, codec=None):
+        self._codec = codec
+        self.durations = {}
+        self.decode_times = {}
+
+    def on_request_start(self, trace):
+        if self._codec is not None:
+            trace.context = self._codec.decode_time
+
+    def on_request_end(self, trace):
+        self.durations.setdefault(trace.action, []).append(trace.duration)
+        if self._codec is not None:
+            decode_time = self._codec.decode_time - trace.context
+            self.decode_times.setdefault(trace.action, []).append(decode_time)
+
+
+def load_credentials(path=None):
+    if path:
+        with open(path) as fh:
+            credentials = json.load(fh)
+    else:
+        credentials = {
+            key: os.environ.get(ENV_PREFIX + key.upper())
+            for key in CREDENTIAL_KEYS
+        }
+    credentials = {key: credentials.get(key) for key in CREDENTIAL_KEYS}
+    if not credentials["username"] or not credentials["password"]:
+        raise SystemExit(
+            "username and password are required, use --credentials or "
+            "{0}USERNAME and {0}PASSWORD environment variables".format(ENV_PREFIX)
+        )
+    credentials["country_code"] = credentials["country_code"] or ""
+    credentials["biz_type"] = credentials["biz_type"] or ""
+    credentials["region"] = credentials["region"] or DEFAULTREGION
+    return credentials
+
+
+def _make_session(args):
+    if args.transport == "replay":
+        if args.replay_file:
+            return TuyaReplaySession.from_file(args.replay_file)
+        return TuyaReplaySession(synthetic_recording(args.devices))
+    if getattr(args, "record", None):
+        return TuyaRecordingSession()
+    return None
+
+
+def _login(api, args, session):
+    if args.transport == "replay":
+        credentials = {
+            "username": "replay",
+            "password": "replay",
+            "country_code": "1",
+            "biz_type": "",
+            "region": DEFAULTREGION,
+        }
+    else:
+        credentials = load_credentials(args.credentials)
+    api.init(
+        credentials["username"],
+        credentials["password"],
+        credentials["country_code"],
+        credentials["biz_type"],
+        credentials["region"],
+        session=session,
+        probe_region=args.probe_region,
+    )
+
+
+def _percentiles(values, points=(50, 90, 99)):
+    values = sorted(values)
+    result = {}
+    for point in points:
+        index = min(len(values) - 1, int(round(point / 100 * (len(values) - 1))))
+        result[point] = values[index]
+    return result
+
+
+def _print_latency(name, values):
+    if not values:
+        print("  {:12s} no calls".format(name))
+        return
+    pct = _percentiles(values)
+    print(
+        "  {:12s} n={:<5d} p50={:8.2f} ms  p90={:8.2f} ms  p99={:8.2f} ms".format(
+            name, len(values), pct[50] * 1000, pct[90] * 1000, pct[99] * 1000
+        )
+    )
+
+
+def cmd_discover(args):
+    session = _make_session(args)
+    api = TuyaApi()
+    codec = _TimingCodec(api.json_codec)
+    api.json_codec = codec
+    hooks = _TimingHooks(codec)
+    api.trace_hooks = hooks
+
+    start = time.perf_counter()
+    _login(api, args, session)
+    total_time = time.perf_counter() - start
+    devices = api.discovery()
+    # device objects are created on first access, all of them here
+    start = time.perf_counter()
+    device_objects = list(api.get_all_devices())
+    build_time = time.perf_counter() - start
+    auth_time = sum(hooks.durations.get("auth", []))
+    request_time = sum(hooks.durations.get("Discovery", []))
+    decode_time = sum(hooks.decode_times.get("Discovery", []))
+
+    if args.raw:
+        pprint.pprint(devices)
+    else:
+        for device in device_objects:
+            print(
+                "{:24s} {:8s} {}".format(
+                    device.object_id(), device.device_type(), device.name()
+                )
+            )
+    print("devices: {}".format(len(devices or [])))
+    print("timing:")
+    print("  auth         {:8.2f} ms".format(auth_time * 1000))
+    print("  http         {:8.2f} ms".format((request_time - decode_time) * 1000))
+    print("  parse        {:8.2f} ms ({})".format(decode_time * 1000, codec.name))
+    print("  device build {:8.2f} ms".format(build_time * 1000))
+    print("  total        {:8.2f} ms".format((total_time + build_time) * 1000))
+
+    if getattr(args, "record", None):
+        session.save(args.record)
+        print("responses saved to {}".format(args.record))
+
+
+def cmd_bench(args):
+    session = _make_session(args)
+    api = TuyaApi()
+    hooks = _TimingHooks()
+    api.trace_hooks = hooks
+    _login(api, args, session)
+
+    if args.device:
+        device = api.get_device_by_id(args.device)
+        if device is None:
+            raise SystemExit("device {} not found".format(args.device))
+    else:
+        devices = [d for d in api.get_all_devices() if d.device_type() != "scene"]
+        if not devices:
+            raise SystemExit("no device to control")
+        device = devices[0]
+    print("device: {!r}".format(device))
+
+    delay = args.delay
+    if delay is None:
+        # the cloud rejects queries sent more often than the query interval
+        delay = 0.0
+        if args.transport == "http":
+            delay = api.effective_query_interval(device.object_id())
+
+    throttled = 0
+    for i in range(args.cycles):
+        value = "1" if i % 2 == 0 else "0"
+        try:
+            api.device_control(device.object_id(), "turnOnOff", {"value": value})
+            api.device_control(device.object_id(), "QueryDevice", namespace="query")
+        except TuyaFrequentlyInvokeException:
+            throttled += 1
+        if delay and i < args.cycles - 1:
+            time.sleep(delay)
+
+    print("latency over {} cycles ({:g} s apart):".format(args.cycles, delay))
+    _print_latency("control", hooks.durations.get("turnOnOff", []))
+    _print_latency("query", hooks.durations.get("QueryDevice", []))
+    print("  throttled    {} of {} cycles".format(throttled, args.cycles))
+
+
+def _poll_once(api):
+    api.poll_devices_update()
+    for device in api.get_all_devices():
+        device.update()
+
+
+def _poll_loop(api, iterations, delay, run=None):
+    """Poll the devices, return the number of throttled iterations.
+
+    Every iteration runs a real discovery: it waits for the discovery
+    interval when delay is set, it forces the discovery otherwise.
+    """
+    throttled = 0
+    for _ in range(iterations):
+        if delay:
+            time.sleep(delay)
+        else:
+            api.force_discovery()
+        try:
+            if run is None:
+                _poll_once(api)
+            else:
+                run(_poll_once, api)
+        except TuyaFrequentlyInvokeException:
+            throttled += 1
+    return throttled
+
+
+def cmd_profile(args):
+    session = _make_session(args)
+    api = TuyaApi()
+    _login(api, args, session)
+
+    delay = args.delay
+    if delay is None:
+        # the cloud rejects discoveries sent more often than the interval
+        delay = 0.0
+        if args.transport == "http":
+            delay = api.effective_discovery_interval()
+
+    if args.mode == "tracemalloc":
+        tracemalloc.start(args.frames)
+        throttled = _poll_loop(api, args.iterations, delay)
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            "traced memory: current={} KiB peak={} KiB".format(
+                current // 1024, peak // 1024
+            )
+        )
+        for stat in snapshot.statistics("lineno")[: args.top]:
+            print(stat)
+    else:
+        # the wait between iterations is not profiled
+        profiler = cProfile.Profile()
+        throttled = _poll_loop(api, args.iterations, delay, profiler.runcall)
+        stats = pstats.Stats(profiler, stream=sys.stdout)
+        stats.sort_stats(args.sort).print_stats(args.top)
+    print("throttled {} of {} iterations".format(throttled, args.iterations))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m tuyaha",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--credentials", help="JSON file with account credentials")
+    common.add_argument(
+        "--transport",
+        choices=("http", "replay"),
+        default="http",
+        help="use Tuya cloud (http) or recorded responses (replay)",
+    )
+    common.add_argument(
+        "--replay-file",
+        help="responses saved by 'discover --record', synthetic if not set",
+    )
+    common.add_argument(
+        "--probe-region",
+        action="store_true",
+        help="log in on all regions at once and keep the first valid answer",
+    )
+    common.add_argument(
+        "--devices",
+        type=int,
+        default=DEF_REPLAY_DEVICES,
+        help="number of synthetic devices used by replay without file",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    discover = subparsers.add_parser(
+        "discover", parents=[common], help="list devices with timing breakdown"
+    )
+    discover.add_argument("--raw", action="store_true", help="print raw response")
+    discover.add_argument("--record", help="save responses to file for replay")
+    discover.set_defaults(func=cmd_discover)
+
+    bench = subparsers.add_parser(
+        "bench", parents=[common], help="measure control and query latency"
+    )
+    bench.add_argument("--cycles", type=int, default=20)
+    bench.add_argument("--device", help="id of the device to control")
+    bench.add_argument(
+        "--delay",
+        type=float,
+        help="seconds to wait between cycles, the device query interval by "
+        "default with the http transport",
+    )
+    bench.set_defaults(func=cmd_bench)
+
+    profile = subparsers.add_parser(
+        "profile", parents=[common], help="profile a polling loop"
+    )
+    profile.add_argument(
+        "--mode", choices=("cprofile", "tracemalloc"), default="cprofile"
+    )
+    profile.add_argument("--iterations", type=int, default=10)
+    profile.add_argument(
+        "--delay",
+        type=float,
+        help="seconds to wait between iterations, the discovery interval by "
+        "default with the http transport",
+    )
+    profile.add_argument("--top", type=int, default=25)
+    profile.add_argument("--sort", default="cumulative", help="cProfile sort key")
+    profile.add_argument(
+        "--frames", type=int, default=1, help="tracemalloc frames to keep"
+    )
+    profile.set_defaults(func=cmd_profile)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
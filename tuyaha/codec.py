@@ -0,0 +1,68 @@
+"""JSON codecs used to encode requests and decode responses"""
+import json
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj):
+    """Convert values json does not know, e.g. NumPy scalars of a snapshot"""
+    item = getattr(obj, "item", None)
+    if item is not None:
+        return item()
+    raise TypeError("Type is not JSON serializable: {}".format(type(obj).__name__))
+
+
+class TuyaJsonCodec:
+    """Encode objects to JSON bytes and decode JSON bytes or str"""
+
+    name = "json"
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(",", ":"), default=_default).encode()
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class TuyaOrjsonCodec(TuyaJsonCodec):
+
+    name = "orjson"
+
+    def dumps(self, obj):
+        # same values accepted by TuyaJsonCodec, whatever the codec used
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+def get_default_codec():
+    """Return the fastest codec available"""
+    if orjson is not None:
+        return TuyaOrjsonCodec()
+    return TuyaJsonCodec()
+
+
+# the header of a skill request only depends on the action, so it is
+# serialized once per action and reused for every request
+@lru_cache(maxsize=64)
+def request_header(name, namespace):
+    header = {"name": name, "namespace": namespace, "payloadVersion": 1}
+    return json.dumps(header, separators=(",", ":")).encode()
+
+
+def build_request(codec, name, namespace, payload):
+    """Return the JSON body of a skill request"""
+    return b"".join(
+        (
+            b'{"header":',
+            request_header(name, namespace),
+            b',"payload":',
+            codec.dumps(payload),
+            b"}",
+        )
+    )
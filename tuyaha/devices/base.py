@@ -1,8 +1,14 @@
 import time
 from datetime import datetime
+from threading import Lock
 
+from tuyaha.locks import TuyaLockOwner
 
-class TuyaDevice:
+
+class TuyaDevice(TuyaLockOwner):
+
+    # recreated when the device is unpickled or forked
+    _lock_attrs = ("_update_lock",)
 
     def __init__(self, data, api):
         self.api = api
@@ -15,6 +21,17 @@ class TuyaDevice:
         self._first_update = True
         self._last_update = datetime.min
         self._last_query = datetime.min
+        self._capabilities = None
+        # only one update at a time, see TuyaApi concurrency contract
+        self._update_lock = Lock()
+        # values written by _update_data, with write time
+        self._optimistic_data = {}
+
+    # pickled with its api, without lock and cached capabilities
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["_capabilities"] = None
+        return state
 
     def name(self):
         return self.obj_name
@@ -45,6 +62,19 @@ class TuyaDevice:
     def iconurl(self):
         return self.icon
 
+    def capabilities(self):
+        """Return the device capabilities, computed once per data change"""
+        if self._capabilities is None:
+            self._capabilities = self._compute_capabilities(self.data or {})
+        return self._capabilities
+
+    # subclasses return here the values of their support_* methods
+    def _compute_capabilities(self, data):
+        return {}
+
+    def _invalidate_capabilities(self):
+        self._capabilities = None
+
     def _update_data(self, key, value, force_val=False):
         if self.data:
             # device properties not provided by Tuya API are saved in the
@@ -52,15 +82,63 @@ class TuyaDevice:
             # in cache missing API values (e.g color mode for light)
             if not force_val and self.data.get(key) is None:
                 return
-            self.data[key] = value
+            with self.api.state_lock:
+                self.data[key] = value
+                self._invalidate_capabilities()
+                self._optimistic_data[key] = (value, datetime.now())
+                current = self.api.get_device_by_id(self.obj_id)
+            if current is not None and current is not self:
+                # device replaced by discovery while the command was running
+                current._update_data(key, value, force_val)
+                return
             self.api.update_device_data(self.obj_id, self.data)
 
-    def _control_device(self, action, param=None):
-        success, response = self.api.device_control(self.obj_id, action, param)
+    # values set by commands sent while a query was running are newer
+    # than the ones returned by the query, so they are kept
+    def _keep_newer_updates(self, data, started):
+        for key, (value, updated) in self._optimistic_data.items():
+            if updated > started and key in data:
+                data[key] = value
+
+    def _control_done(self, success):
         if not success:
             self._update_data("online", False)
         else:
             self._last_update = datetime.now()
+
+    def _control_device(self, action, param=None):
+        success, response = self.api.device_control(self.obj_id, action, param)
+        self._control_done(success)
+        return success
+
+    async def _async_control_device(self, action, param=None):
+        success, response = await self.api.async_device_control(
+            self.obj_id, action, param
+        )
+        self._control_done(success)
+        return success
+
+    # updates is the list of cache changes done when the command succeeds,
+    # each one is a (key, value[, force_val]) tuple or a callable.
+    # Control methods build action, param and updates in a _*_command
+    # method shared by the sync and the async version
+    def _apply_updates(self, updates):
+        for update in updates:
+            if callable(update):
+                update()
+            else:
+                self._update_data(*update)
+
+    def _command(self, action, param, updates):
+        success = self._control_device(action, param)
+        if success:
+            self._apply_updates(updates)
+        return success
+
+    async def _async_command(self, action, param, updates):
+        success = await self._async_control_device(action, param)
+        if success:
+            self._apply_updates(updates)
         return success
 
     # Update device cache using discovery or query command
@@ -70,53 +148,148 @@ class TuyaDevice:
     # Query can be called with higher frequency but return
     # values for a single device
     def _update(self, use_discovery):
+        with self._update_lock:
+            updated, reloaded = self._update_locked(use_discovery)
+        self._notify_update(updated, reloaded)
+        return updated
+
+    async def _async_update(self, use_discovery):
+        # a coroutine never waits for an update running in another thread
+        # or task, the data cached by that update is used instead
+        if not self._update_lock.acquire(blocking=False):
+            return
+        try:
+            updated, reloaded = await self._async_update_locked(use_discovery)
+        finally:
+            self._update_lock.release()
+        self._notify_update(updated, reloaded)
+        return updated
+
+    # listeners are called once the update lock is released, so they can
+    # update the device again
+    def _notify_update(self, updated, reloaded):
+        if reloaded:
+            self.api.notify_state_changed(None)
+        if updated:
+            self.api.notify_state_changed(self.obj_id)
+
+    # query the device whatever the query interval, e.g. to read the
+    # changes made by a scene
+    def _query(self):
+        with self._update_lock:
+            updated = self._query_locked()
+        if updated:
+            self.api.notify_state_changed(self.obj_id)
+        return updated
+
+    async def _async_query(self):
+        if not self._update_lock.acquire(blocking=False):
+            return
+        try:
+            updated = await self._async_query_locked()
+        finally:
+            self._update_lock.release()
+        if updated:
+            self.api.notify_state_changed(self.obj_id)
+        return updated
+
+    # return (use_discovery, delay) for the next update, None to skip it
+    def _update_plan(self, use_discovery):
 
         # Avoid get cache value after control.
         difference = (datetime.now() - self._last_update).total_seconds()
         wait_delay = difference < 0.5
 
-        data = None
         if use_discovery or self._first_update:
-            if wait_delay:
-                time.sleep(0.5)
             # workaround for https://github.com/PaulAnnekov/tuyaha/issues/3
             self._first_update = False
-            devices = self.api.discovery()
-            if not devices:
-                return
-            for device in devices:
-                if device["id"] == self.obj_id:
-                    data = device["data"]
-                    break
+            return True, 0.5 if wait_delay else 0
 
-        else:
-            # query can be called once every 60 seconds
-            difference = (datetime.now() - self._last_query).total_seconds()
-            if difference < self.api.query_interval:
-                return
-            if difference == self.api.query_interval:
-                wait_delay = True
-            if wait_delay:
-                time.sleep(0.5)
-
-            try:
-                success, response = self.api.device_control(
-                    self.obj_id, "QueryDevice", namespace="query"
-                )
-            finally:
-                self._last_query = datetime.now()
-            if success:
-                data = response["payload"]["data"]
+        # query can be called once every 60 seconds
+        query_interval = self.api.effective_query_interval(self.obj_id)
+        difference = (datetime.now() - self._last_query).total_seconds()
+        if difference < query_interval:
+            return None
+        if difference == query_interval:
+            wait_delay = True
+        return False, 0.5 if wait_delay else 0
+
+    def _query_data(self, success, response, started):
+        if not success:
+            return None
+        data = response["payload"]["data"]
+        self._keep_newer_updates(data, started)
+        self.api.notify_device_data(self.obj_id, self.data, data)
+        return data
 
+    def _merge_data(self, data):
         if data:
-            if not self.data:
+            if self.data is None:
                 self.data = data
             else:
                 self.data.update(data)
+            self._invalidate_capabilities()
+            self.api.state_merged(self.obj_id)
             return True
 
         return
 
+    # return (updated, reloaded), reloaded is True when the discovery run
+    # by the update reloaded all the devices
+    def _update_locked(self, use_discovery):
+        plan = self._update_plan(use_discovery)
+        if plan is None:
+            return None, False
+        use_discovery, delay = plan
+        if delay:
+            time.sleep(delay)
+
+        if use_discovery:
+            devices, reloaded = self.api._discover()
+            if not devices:
+                return None, reloaded
+            return self._merge_data(self.api.device_state(self.obj_id)), reloaded
+
+        return self._query_locked(), False
+
+    def _query_locked(self):
+        started = datetime.now()
+        try:
+            success, response = self.api.device_control(
+                self.obj_id, "QueryDevice", namespace="query"
+            )
+        finally:
+            self._last_query = datetime.now()
+        return self._merge_data(self._query_data(success, response, started))
+
+    async def _async_update_locked(self, use_discovery):
+        plan = self._update_plan(use_discovery)
+        if plan is None:
+            return None, False
+        use_discovery, delay = plan
+        if delay:
+            import asyncio
+
+            await asyncio.sleep(delay)
+
+        if use_discovery:
+            devices, reloaded = await self.api._async_discover()
+            if not devices:
+                return None, reloaded
+            return self._merge_data(self.api.device_state(self.obj_id)), reloaded
+
+        return await self._async_query_locked(), False
+
+    async def _async_query_locked(self):
+        started = datetime.now()
+        try:
+            success, response = await self.api.async_device_control(
+                self.obj_id, "QueryDevice", namespace="query"
+            )
+        finally:
+            self._last_query = datetime.now()
+        return self._merge_data(self._query_data(success, response, started))
+
     def __repr__(self):
         module = self.__class__.__module__
         if module is None or module == str.__class__.__module__:
@@ -132,3 +305,6 @@ class TuyaDevice:
 
     def update(self, use_discovery=True):
         return self._update(use_discovery)
+
+    async def async_update(self, use_discovery=True):
+        return await self._async_update(use_discovery)
@@ -163,9 +163,7 @@ class TuyaClimate(TuyaDevice):
     def max_humidity(self):
         pass
 
-    def set_temperature(self, temperature, use_divider=True):
-        """Set new target temperature."""
-
+    def _set_temperature_command(self, temperature, use_divider):
         # the value used to set temperature is scaled based on the configured divider
         divider = self._divider or 1
         input_val = float(temperature)
@@ -179,8 +177,34 @@ class TuyaClimate(TuyaDevice):
         else:
             temp_val = set_val
 
-        if self._control_device("temperatureSet", {"value": temp_val}):
-            self._update_data("temperature", set_val)
+        return "temperatureSet", {"value": temp_val}, [("temperature", set_val)]
+
+    def _set_fan_mode_command(self, fan_mode):
+        fanList = self.fan_list()
+        if fan_mode in fanList:
+            val = str(fanList.index(fan_mode) + 1)
+        else:
+            val = fan_mode
+        return "windSpeedSet", {"value": fan_mode}, [("windspeed", val)]
+
+    def _set_operation_mode_command(self, operation_mode):
+        return "modeSet", {"value": operation_mode}, [("mode", operation_mode)]
+
+    def _turn_on_command(self):
+        return "turnOnOff", {"value": "1"}, [("state", "true")]
+
+    def _turn_off_command(self):
+        return "turnOnOff", {"value": "0"}, [("state", "false")]
+
+    def set_temperature(self, temperature, use_divider=True):
+        """Set new target temperature."""
+        return self._command(*self._set_temperature_command(temperature, use_divider))
+
+    async def async_set_temperature(self, temperature, use_divider=True):
+        """Set new target temperature."""
+        return await self._async_command(
+            *self._set_temperature_command(temperature, use_divider)
+        )
 
     def set_humidity(self, humidity):
         """Set new target humidity."""
@@ -188,51 +212,54 @@ class TuyaClimate(TuyaDevice):
 
     def set_fan_mode(self, fan_mode):
         """Set new target fan mode."""
-        if self._control_device("windSpeedSet", {"value": fan_mode}):
-            fanList = self.fan_list()
-            if fan_mode in fanList:
-                val = str(fanList.index(fan_mode) + 1)
-            else:
-                val = fan_mode
-            self._update_data("windspeed", val)
+        return self._command(*self._set_fan_mode_command(fan_mode))
+
+    async def async_set_fan_mode(self, fan_mode):
+        """Set new target fan mode."""
+        return await self._async_command(*self._set_fan_mode_command(fan_mode))
 
     def set_operation_mode(self, operation_mode):
         """Set new target operation mode."""
-        if self._control_device("modeSet", {"value": operation_mode}):
-            self._update_data("mode", operation_mode)
+        return self._command(*self._set_operation_mode_command(operation_mode))
+
+    async def async_set_operation_mode(self, operation_mode):
+        """Set new target operation mode."""
+        return await self._async_command(
+            *self._set_operation_mode_command(operation_mode)
+        )
 
     def set_swing_mode(self, swing_mode):
         """Set new target swing operation."""
         raise NotImplementedError()
 
+    def _compute_capabilities(self, data):
+        return {
+            "support_target_temperature": data.get("temperature") is not None,
+            "support_mode": data.get("mode") is not None,
+            "support_wind_speed": data.get("windspeed") is not None,
+            "support_humidity": data.get("humidity") is not None,
+        }
+
     def support_target_temperature(self):
-        if self.data.get("temperature") is not None:
-            return True
-        else:
-            return False
+        return self.capabilities()["support_target_temperature"]
 
     def support_mode(self):
-        if self.data.get("mode") is not None:
-            return True
-        else:
-            return False
+        return self.capabilities()["support_mode"]
 
     def support_wind_speed(self):
-        if self.data.get("windspeed") is not None:
-            return True
-        else:
-            return False
+        return self.capabilities()["support_wind_speed"]
 
     def support_humidity(self):
-        if self.data.get("humidity") is not None:
-            return True
-        else:
-            return False
+        return self.capabilities()["support_humidity"]
 
     def turn_on(self):
-        if self._control_device("turnOnOff", {"value": "1"}):
-            self._update_data("state", "true")
+        return self._command(*self._turn_on_command())
 
     def turn_off(self):
-        if self._control_device("turnOnOff", {"value": "0"}):
-            self._update_data("state", "false")
+        return self._command(*self._turn_off_command())
+
+    async def async_turn_on(self):
+        return await self._async_command(*self._turn_on_command())
+
+    async def async_turn_off(self):
+        return await self._async_command(*self._turn_off_command())
@@ -0,0 +1,100 @@
+"""List of discovered devices, device objects are created on first access"""
+from collections.abc import Sequence
+from threading import Lock
+
+from tuyaha.devices.factory import DEVICE_TYPES, get_tuya_device
+from tuyaha.locks import TuyaLockOwner
+
+
+class TuyaDeviceList(TuyaLockOwner, Sequence):
+    """Sequence of the devices returned by discovery.
+
+    Ids and types are read from the discovery entries. A device object is
+    created only when the device is accessed by index, id, type or by
+    iterating the list, so unused devices cost only their entry.
+    """
+
+    def __init__(self, entries=(), api=None):
+        self._api = api
+        self._lock = Lock()
+        self._entries = {}
+        self._ids = []
+        self._ids_by_type = {}
+        self._objects = {}
+        for entry in entries:
+            dev_type = entry.get("dev_type")
+            if dev_type not in DEVICE_TYPES:
+                continue
+            dev_id = entry.get("id")
+            if dev_id not in self._entries:
+                self._ids.append(dev_id)
+                self._ids_by_type.setdefault(dev_type, []).append(dev_id)
+            self._entries[dev_id] = entry
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.get(dev_id) for dev_id in self._ids[index]]
+        return self.get(self._ids[index])
+
+    def __iter__(self):
+        for dev_id in self._ids:
+            yield self.get(dev_id)
+
+    def __contains__(self, device):
+        dev_id = getattr(device, "obj_id", None)
+        return dev_id is not None and self._objects.get(dev_id) is device
+
+    def __repr__(self):
+        return "<{}: {} devices, {} created>".format(
+            self.__class__.__name__, len(self._ids), len(self._objects)
+        )
+
+    def ids(self):
+        """Return the ids of all the devices without creating them"""
+        return list(self._ids)
+
+    def entry(self, dev_id):
+        """Return the discovery entry of a device, None if unknown"""
+        return self._entries.get(dev_id)
+
+    def entries(self, dev_type=None):
+        """Return the discovery entries of all the devices or of a type"""
+        if dev_type is None:
+            ids = self._ids
+        else:
+            ids = self._ids_by_type.get(dev_type, ())
+        return [self._entries[dev_id] for dev_id in ids]
+
+    def get(self, dev_id, create=True):
+        """Return the device object, created if needed and create is True"""
+        device = self._objects.get(dev_id)
+        if device is not None or not create:
+            return device
+        entry = self._entries.get(dev_id)
+        if entry is None:
+            return None
+        with self._lock:
+            # created once, device objects are compared by identity
+            device = self._objects.get(dev_id)
+            if device is None:
+                device = get_tuya_device(entry, self._api)[0]
+                self._objects[dev_id] = device
+        return device
+
+    def of_type(self, dev_type):
+        """Return the device objects of a type, e.g. light"""
+        return [self.get(dev_id) for dev_id in self._ids_by_type.get(dev_type, ())]
+
+    def created(self):
+        """Return the device objects already created"""
+        return list(self._objects.values())
+
+    def adopt(self, device, dev_id=None):
+        """Use an existing object for the device with the same id"""
+        if dev_id is None:
+            dev_id = device.object_id()
+        with self._lock:
+            self._objects[dev_id] = device
@@ -7,23 +7,42 @@ class TuyaCover(TuyaDevice):
         state = self.data.get("state")
         return state
 
+    def _open_cover_command(self):
+        return "turnOnOff", {"value": "1"}, [("state", 1)]
+
+    def _close_cover_command(self):
+        return "turnOnOff", {"value": "0"}, [("state", 2)]
+
+    def _stop_cover_command(self):
+        return "startStop", {"value": "0"}, [("state", 3)]
+
     def open_cover(self):
         """Open the cover."""
-        if self._control_device("turnOnOff", {"value": "1"}):
-            self._update_data("state", 1)
+        return self._command(*self._open_cover_command())
 
     def close_cover(self):
         """Close cover."""
-        if self._control_device("turnOnOff", {"value": "0"}):
-            self._update_data("state", 2)
+        return self._command(*self._close_cover_command())
 
     def stop_cover(self):
         """Stop the cover."""
-        if self._control_device("startStop", {"value": "0"}):
-            self._update_data("state", 3)
+        return self._command(*self._stop_cover_command())
+
+    async def async_open_cover(self):
+        """Open the cover."""
+        return await self._async_command(*self._open_cover_command())
+
+    async def async_close_cover(self):
+        """Close cover."""
+        return await self._async_command(*self._close_cover_command())
+
+    async def async_stop_cover(self):
+        """Stop the cover."""
+        return await self._async_command(*self._stop_cover_command())
 
     def support_stop(self):
-        support = self.data.get("support_stop")
-        if support is None:
-            return False
-        return support
+        return self.capabilities()["support_stop"]
+
+    def _compute_capabilities(self, data):
+        support = data.get("support_stop")
+        return {"support_stop": False if support is None else support}
@@ -6,6 +6,9 @@ from tuyaha.devices.lock import TuyaLock
 from tuyaha.devices.scene import TuyaScene
 from tuyaha.devices.switch import TuyaSwitch
 
+# device types that get_tuya_device can create
+DEVICE_TYPES = ("light", "climate", "scene", "fan", "cover", "lock", "switch")
+
 
 def get_tuya_device(data, api):
     dev_type = data.get("dev_type")
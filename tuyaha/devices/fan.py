@@ -7,40 +7,60 @@ class TuyaFanDevice(TuyaDevice):
         return self.data.get("speed")
 
     def speed_list(self):
-        speed_list = []
-        speed_level = self.data.get("speed_level")
-        for i in range(speed_level):
-            speed_list.append(str(i + 1))
-        return speed_list
+        return self.capabilities()["speed_list"]
+
+    def _compute_capabilities(self, data):
+        speed_level = data.get("speed_level") or 0
+        return {
+            "speed_list": [str(i + 1) for i in range(speed_level)],
+            "support_oscillate": data.get("direction") is not None,
+        }
 
     def oscillating(self):
         return self.data.get("direction")
 
-    def set_speed(self, speed):
-        if self._control_device("windSpeedSet", {"value": speed}):
-            self._update_data("speed", speed)
+    def _set_speed_command(self, speed):
+        return "windSpeedSet", {"value": speed}, [("speed", speed)]
 
-    def oscillate(self, oscillating):
+    def _oscillate_command(self, oscillating):
         if oscillating:
             command = "swingOpen"
         else:
             command = "swingClose"
-        if self._control_device(command):
-            self._update_data("direction", oscillating)
+        return command, None, [("direction", oscillating)]
+
+    def _turn_on_command(self):
+        return "turnOnOff", {"value": "1"}, [("state", "true")]
+
+    def _turn_off_command(self):
+        return "turnOnOff", {"value": "0"}, [("state", "false")]
+
+    def set_speed(self, speed):
+        return self._command(*self._set_speed_command(speed))
+
+    def oscillate(self, oscillating):
+        return self._command(*self._oscillate_command(oscillating))
 
     def turn_on(self):
-        if self._control_device("turnOnOff", {"value": "1"}):
-            self._update_data("state", "true")
+        return self._command(*self._turn_on_command())
 
     def turn_off(self):
-        if self._control_device("turnOnOff", {"value": "0"}):
-            self._update_data("state", "false")
+        return self._command(*self._turn_off_command())
+
+    async def async_set_speed(self, speed):
+        return await self._async_command(*self._set_speed_command(speed))
+
+    async def async_oscillate(self, oscillating):
+        return await self._async_command(*self._oscillate_command(oscillating))
+
+    async def async_turn_on(self):
+        return await self._async_command(*self._turn_on_command())
+
+    async def async_turn_off(self):
+        return await self._async_command(*self._turn_off_command())
 
     def support_oscillate(self):
-        if self.oscillating() is None:
-            return False
-        else:
-            return True
+        return self.capabilities()["support_oscillate"]
 
     def support_direction(self):
         return False
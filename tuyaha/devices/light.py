@@ -26,6 +26,15 @@ class TuyaLight(TuyaDevice):
     # the attribute _support_color is used by method support_color()
     def force_support_color(self):
         self._support_color = True
+        self._invalidate_capabilities()
+
+    def _compute_capabilities(self, data):
+        if data.get("color") or data.get("color_mode") == "colour":
+            self._support_color = True
+        return {
+            "support_color": self._support_color,
+            "support_color_temp": data.get("color_temp") is not None,
+        }
 
     def _color_mode(self):
         work_mode = self.data.get("color_mode", "white")
@@ -71,14 +80,11 @@ class TuyaLight(TuyaDevice):
 
     def support_color(self):
         """return if the light support color"""
-        if not self._support_color:
-            if self.data.get("color") or self.data.get("color_mode") == "colour":
-                self._support_color = True
-        return self._support_color
+        return self.capabilities()["support_color"]
 
     def support_color_temp(self):
         """return if the light support color temperature"""
-        return self.data.get("color_temp") is not None
+        return self.capabilities()["support_color_temp"]
 
     def hs_color(self):
         """return current hs color"""
@@ -108,37 +114,31 @@ class TuyaLight(TuyaDevice):
     def max_color_temp(self):
         return COLTEMP_KELV_RANGE[0]
 
-    def turn_on(self):
-        if self._control_device("turnOnOff", {"value": "1"}):
-            self._update_data("state", "true")
+    def _turn_on_command(self):
+        return "turnOnOff", {"value": "1"}, [("state", "true")]
 
-    def turn_off(self):
-        if self._control_device("turnOnOff", {"value": "0"}):
-            self._update_data("state", "false")
+    def _turn_off_command(self):
+        return "turnOnOff", {"value": "0"}, [("state", "false")]
 
-    def set_brightness(self, brightness):
-        """Set the brightness(0-255) of light."""
-        if int(brightness) > 0:
-            # convert to scale 0-100 with MIN_BRIGHTNESS to set the value
-            set_value = TuyaLight._scale(
-                brightness,
-                BRIGHTNESS_STD_RANGE,
-                (MIN_BRIGHTNESS, 100),
-            )
-            if self._control_device("brightnessSet", {"value": round(set_value, 1)}):
-                self._update_data("state", "true")
-                # convert to scale configured for brightness range to update the cache
-                value = TuyaLight._scale(
-                    brightness,
-                    BRIGHTNESS_STD_RANGE,
-                    self._brightness_range(),
-                )
-                self._set_brightness(round(value))
-        else:
-            self.turn_off()
+    def _set_brightness_command(self, brightness):
+        if int(brightness) <= 0:
+            return self._turn_off_command()
+        # convert to scale 0-100 with MIN_BRIGHTNESS to set the value
+        set_value = TuyaLight._scale(
+            brightness,
+            BRIGHTNESS_STD_RANGE,
+            (MIN_BRIGHTNESS, 100),
+        )
+        # convert to scale configured for brightness range to update the cache
+        value = TuyaLight._scale(
+            brightness,
+            BRIGHTNESS_STD_RANGE,
+            self._brightness_range(),
+        )
+        updates = [("state", "true"), lambda: self._set_brightness(round(value))]
+        return "brightnessSet", {"value": round(set_value, 1)}, updates
 
-    def set_color(self, color):
-        """Set the color of light."""
+    def _set_color_command(self, color):
         cur_brightness = self.data.get("color", {}).get(
             "brightness", self.brightness_color_range[0]
         )
@@ -153,29 +153,65 @@ class TuyaLight(TuyaDevice):
         # color white
         white_mode = hsv_color["saturation"] == 0
         is_color = self._color_mode()
-        if self._control_device("colorSet", {"color": hsv_color}):
-            self._update_data("state", "true")
-            self._update_data("color", hsv_color, force_val=True)
-            if not is_color and not white_mode:
-                self._update_data("color_mode", "colour")
-            elif is_color and white_mode:
-                self._update_data("color_mode", "white")
-
-    def set_color_temp(self, color_temp):
-        """Set the color temperature of light."""
+        updates = [("state", "true"), ("color", hsv_color, True)]
+        if not is_color and not white_mode:
+            updates.append(("color_mode", "colour"))
+        elif is_color and white_mode:
+            updates.append(("color_mode", "white"))
+        return "colorSet", {"color": hsv_color}, updates
+
+    def _set_color_temp_command(self, color_temp):
         # convert to scale configured for color temperature to update the value
         set_value = TuyaLight._scale(
             color_temp,
             COLTEMP_KELV_RANGE,
             COLTEMP_SET_RANGE,
         )
-        if self._control_device("colorTemperatureSet", {"value": round(set_value)}):
-            self._update_data("state", "true")
-            self._update_data("color_mode", "white")
-            # convert to scale configured for color temperature to update the cache
-            data_value = TuyaLight._scale(
-                color_temp,
-                COLTEMP_KELV_RANGE,
-                self.color_temp_range,
-            )
-            self._update_data("color_temp", round(data_value))
+        # convert to scale configured for color temperature to update the cache
+        data_value = TuyaLight._scale(
+            color_temp,
+            COLTEMP_KELV_RANGE,
+            self.color_temp_range,
+        )
+        updates = [
+            ("state", "true"),
+            ("color_mode", "white"),
+            ("color_temp", round(data_value)),
+        ]
+        return "colorTemperatureSet", {"value": round(set_value)}, updates
+
+    def turn_on(self):
+        return self._command(*self._turn_on_command())
+
+    def turn_off(self):
+        return self._command(*self._turn_off_command())
+
+    def set_brightness(self, brightness):
+        """Set the brightness(0-255) of light."""
+        return self._command(*self._set_brightness_command(brightness))
+
+    def set_color(self, color):
+        """Set the color of light."""
+        return self._command(*self._set_color_command(color))
+
+    def set_color_temp(self, color_temp):
+        """Set the color temperature of light."""
+        return self._command(*self._set_color_temp_command(color_temp))
+
+    async def async_turn_on(self):
+        return await self._async_command(*self._turn_on_command())
+
+    async def async_turn_off(self):
+        return await self._async_command(*self._turn_off_command())
+
+    async def async_set_brightness(self, brightness):
+        """Set the brightness(0-255) of light."""
+        return await self._async_command(*self._set_brightness_command(brightness))
+
+    async def async_set_color(self, color):
+        """Set the color of light."""
+        return await self._async_command(*self._set_color_command(color))
+
+    async def async_set_color_temp(self, color_temp):
+        """Set the color temperature of light."""
+        return await self._async_command(*self._set_color_temp_command(color_temp))
@@ -6,7 +6,17 @@ class TuyaScene(TuyaDevice):
         return True
 
     def activate(self):
-        self.api.device_control(self.obj_id, "turnOnOff", {"value": "1"})
+        success, _ = self.api.device_control(self.obj_id, "turnOnOff", {"value": "1"})
+        return success
+
+    async def async_activate(self):
+        success, _ = await self.api.async_device_control(
+            self.obj_id, "turnOnOff", {"value": "1"}
+        )
+        return success
 
     def update(self, use_discovery=True):
         return True
+
+    async def async_update(self, use_discovery=True):
+        return True
@@ -4,13 +4,26 @@ from tuyaha.devices.base import TuyaDevice
 
 class TuyaSwitch(TuyaDevice):
 
+    def _turn_on_command(self):
+        return "turnOnOff", {"value": "1"}, [("state", True)]
+
+    def _turn_off_command(self):
+        return "turnOnOff", {"value": "0"}, [("state", False)]
+
     def turn_on(self):
-        if self._control_device("turnOnOff", {"value": "1"}):
-            self._update_data("state", True)
+        return self._command(*self._turn_on_command())
 
     def turn_off(self):
-        if self._control_device("turnOnOff", {"value": "0"}):
-            self._update_data("state", False)
+        return self._command(*self._turn_off_command())
+
+    async def async_turn_on(self):
+        return await self._async_command(*self._turn_on_command())
+
+    async def async_turn_off(self):
+        return await self._async_command(*self._turn_off_command())
 
     def update(self, use_discovery=True):
         return self._update(use_discovery=True)
+
+    async def async_update(self, use_discovery=True):
+        return await self._async_update(use_discovery=True)
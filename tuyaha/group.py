@@ -0,0 +1,176 @@
+"""Groups of devices controlled together, with aggregated state"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from tuyaha.devices.light import TuyaLight
+
+_LOGGER = logging.getLogger(__name__)
+
+# maximum number of control commands sent at the same time by a group
+DEF_MAX_WORKERS = 8
+
+
+class TuyaDeviceGroup:
+    """A set of devices, identified by id, controlled with a single call.
+
+    Commands are sent to all members concurrently. The aggregated state is
+    updated for a single member every time the api reports a change of its
+    cached state, without scanning the other members.
+    """
+
+    def __init__(self, api, dev_ids, name=None, max_workers=DEF_MAX_WORKERS):
+        self.api = api
+        self.name = name
+        self._dev_ids = list(dict.fromkeys(dev_ids))
+        self._members = set(self._dev_ids)
+        self._max_workers = max_workers
+        self._executor = None
+        self._lock = Lock()
+        self._contributions = {}
+        self._available_count = 0
+        self._on_count = 0
+        self._brightness_sum = 0
+        self._brightness_count = 0
+        self._refresh_all()
+        api.add_state_listener(self._state_changed)
+
+    @classmethod
+    def from_type(cls, api, dev_type, name=None, **kwargs):
+        """Create a group with all the devices of a type, e.g. light"""
+        dev_ids = [device.object_id() for device in api.get_devices_by_type(dev_type)]
+        return cls(api, dev_ids, name or dev_type, **kwargs)
+
+    def close(self):
+        """Stop tracking member state and release the worker threads"""
+        try:
+            self.api.remove_state_listener(self._state_changed)
+        except ValueError:
+            pass
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def __repr__(self):
+        return '<{}: "{}" ({} devices)>'.format(
+            self.__class__.__name__, self.name, len(self._dev_ids)
+        )
+
+    def member_ids(self):
+        return list(self._dev_ids)
+
+    def devices(self):
+        """Return the current device objects of the members"""
+        devices = []
+        for dev_id in self._dev_ids:
+            device = self.api.get_device_by_id(dev_id)
+            if device is not None:
+                devices.append(device)
+        return devices
+
+    # aggregated state
+
+    def is_on(self):
+        """Return True if at least one member is on"""
+        return self._on_count > 0
+
+    def on_count(self):
+        return self._on_count
+
+    def available_count(self):
+        return self._available_count
+
+    def brightness(self):
+        """Return the mean brightness of the lights that are on"""
+        if not self._brightness_count:
+            return None
+        return round(self._brightness_sum / self._brightness_count)
+
+    def _contribution(self, dev_id):
+        device = self.api.get_device_by_id(dev_id)
+        if device is None or not device.data:
+            return False, False, None
+        available = bool(device.available())
+        is_on = device.state() is True
+        brightness = None
+        if is_on and isinstance(device, TuyaLight):
+            try:
+                brightness = device.brightness()
+            except (TypeError, ValueError, AttributeError):
+                brightness = None
+        return available, is_on, brightness
+
+    def _apply(self, contribution, sign):
+        available, is_on, brightness = contribution
+        self._available_count += sign * available
+        self._on_count += sign * is_on
+        if brightness is not None:
+            self._brightness_sum += sign * brightness
+            self._brightness_count += sign
+
+    def _refresh_member(self, dev_id):
+        new = self._contribution(dev_id)
+        old = self._contributions.get(dev_id)
+        if old == new:
+            return
+        if old is not None:
+            self._apply(old, -1)
+        self._apply(new, 1)
+        self._contributions[dev_id] = new
+
+    def _refresh_all(self):
+        with self._lock:
+            for dev_id in self._dev_ids:
+                self._refresh_member(dev_id)
+
+    def _state_changed(self, dev_id):
+        if dev_id is None:
+            self._refresh_all()
+        elif dev_id in self._members:
+            with self._lock:
+                self._refresh_member(dev_id)
+
+    # control
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._max_workers,
+                thread_name_prefix="tuyaha-group",
+            )
+        return self._executor
+
+    def _dispatch(self, method, *args):
+        """Call method on every member supporting it, return success by id"""
+        devices = [device for device in self.devices() if hasattr(device, method)]
+        if not devices:
+            return {}
+        executor = self._get_executor()
+        futures = {
+            device.object_id(): executor.submit(getattr(device, method), *args)
+            for device in devices
+        }
+        results = {}
+        for dev_id, future in futures.items():
+            try:
+                results[dev_id] = bool(future.result())
+            except Exception as ex:
+                _LOGGER.warning(
+                    "group %s: %s failed for device %s: %s",
+                    self.name,
+                    method,
+                    dev_id,
+                    ex,
+                )
+                results[dev_id] = False
+        return results
+
+    def turn_on(self):
+        return self._dispatch("turn_on")
+
+    def turn_off(self):
+        return self._dispatch("turn_off")
+
+    def set_brightness(self, brightness):
+        """Set the brightness(0-255) of all the lights in the group"""
+        return self._dispatch("set_brightness", brightness)
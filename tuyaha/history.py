@@ -0,0 +1,165 @@
+"""Recent state history of devices stored in fixed size ring buffers"""
+import math
+import time
+from array import array
+from threading import Lock
+
+from tuyaha.locks import TuyaLockOwner
+
+DEF_HISTORY_SIZE = 64
+DEF_HISTORY_FIELDS = ("state", "brightness", "current_temperature", "online")
+
+
+def _encode(value):
+    """Convert a device data value to the float stored in the buffer"""
+    if value is None:
+        return math.nan
+    if isinstance(value, str):
+        if value == "true":
+            return 1.0
+        if value == "false":
+            return 0.0
+        try:
+            return float(value)
+        except ValueError:
+            return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _decode(value):
+    return None if math.isnan(value) else value
+
+
+class TuyaRingBuffer:
+    """Fixed size buffer of (timestamp, value) samples, oldest overwritten"""
+
+    __slots__ = ("_times", "_values", "_next", "_count")
+
+    def __init__(self, size):
+        self._times = array("d", bytes(8 * size))
+        self._values = array("d", bytes(8 * size))
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def size(self):
+        return len(self._times)
+
+    def append(self, timestamp, value):
+        self._times[self._next] = timestamp
+        self._values[self._next] = value
+        self._next = (self._next + 1) % len(self._times)
+        if self._count < len(self._times):
+            self._count += 1
+
+    def last(self):
+        """Return the last (timestamp, value) sample or None if empty"""
+        if not self._count:
+            return None
+        pos = (self._next - 1) % len(self._times)
+        return self._times[pos], self._values[pos]
+
+    def samples(self, start=None, end=None):
+        """Return samples in chronological order between start and end"""
+        size = len(self._times)
+        first = (self._next - self._count) % size
+        result = []
+        for i in range(self._count):
+            pos = (first + i) % size
+            timestamp = self._times[pos]
+            if start is not None and timestamp < start:
+                continue
+            if end is not None and timestamp > end:
+                break
+            result.append((timestamp, self._values[pos]))
+        return result
+
+
+class TuyaHistoryRecorder(TuyaLockOwner):
+    """Record the changes of selected data fields for every device.
+
+    A sample is added only when the value of a field changes, so the
+    buffers cover a longer time span for devices that seldom change.
+    Memory used for a device is bounded by fields * size * 16 bytes.
+    """
+
+    def __init__(self, size=DEF_HISTORY_SIZE, fields=DEF_HISTORY_FIELDS):
+        if size < 1:
+            raise ValueError("History size must be a positive value")
+        self._size = size
+        self._fields = tuple(fields)
+        self._buffers = {}
+        self._lock = Lock()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def fields(self):
+        return self._fields
+
+    def record(self, dev_id, data, timestamp=None):
+        """Add to history the fields of data that changed for the device"""
+        if not data:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            buffers = self._buffers.get(dev_id)
+            if buffers is None:
+                buffers = self._buffers[dev_id] = {}
+            for field in self._fields:
+                if field not in data:
+                    continue
+                value = _encode(data[field])
+                buffer = buffers.get(field)
+                if buffer is None:
+                    buffer = buffers[field] = TuyaRingBuffer(self._size)
+                else:
+                    last_val = buffer.last()[1]
+                    if last_val == value or (
+                        math.isnan(last_val) and math.isnan(value)
+                    ):
+                        continue
+                buffer.append(timestamp, value)
+
+    def history(self, dev_id, field, start=None, end=None):
+        """Return the list of (timestamp, value) changes for a device field"""
+        with self._lock:
+            buffer = self._buffers.get(dev_id, {}).get(field)
+            if buffer is None:
+                return []
+            samples = buffer.samples(start, end)
+        return [(timestamp, _decode(value)) for timestamp, value in samples]
+
+    def last_change(self, dev_id, field):
+        """Return the last (timestamp, value) change for a device field"""
+        with self._lock:
+            buffer = self._buffers.get(dev_id, {}).get(field)
+            sample = buffer.last() if buffer is not None else None
+        if sample is None:
+            return None
+        return sample[0], _decode(sample[1])
+
+    def change_count(self, dev_id, field, start=None, end=None):
+        """Return the number of recorded changes in the time range"""
+        return len(self.history(dev_id, field, start, end))
+
+    def devices(self):
+        with self._lock:
+            return list(self._buffers)
+
+    def forget(self, dev_id):
+        with self._lock:
+            self._buffers.pop(dev_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._buffers = {}
@@ -0,0 +1,31 @@
+"""Locks of the objects that can be pickled or used after fork"""
+from threading import Lock
+
+
+class TuyaLockOwner:
+    """Mixin creating new locks when the object is unpickled or forked.
+
+    The attributes named in _lock_attrs are not pickled. They are replaced
+    by new locks when the object is unpickled and in the child process
+    after fork (see TuyaApi), where a lock may have been held by a thread
+    of the parent.
+    """
+
+    _lock_attrs = ("_lock",)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in self._lock_attrs:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._new_locks()
+
+    def _after_fork(self):
+        self._new_locks()
+
+    def _new_locks(self):
+        for name in self._lock_attrs:
+            setattr(self, name, Lock())
@@ -0,0 +1,77 @@
+"""Adaptive polling intervals based on observed device change rate"""
+from threading import Lock
+
+from tuyaha.locks import TuyaLockOwner
+
+# key used to track changes observed by discovery command
+DISCOVERY_KEY = "__discovery__"
+
+DEF_MIN_FACTOR = 0.25
+DEF_MAX_FACTOR = 4.0
+DEF_INCREASE_FACTOR = 1.5
+DEF_DECREASE_FACTOR = 0.5
+
+
+class TuyaAdaptivePolling(TuyaLockOwner):
+    """Scale the configured poll intervals for each device.
+
+    Every update that returns unchanged data multiplies the interval
+    factor of the device by increase_factor, every update that returns
+    changed data multiplies it by decrease_factor. The resulting interval
+    is the configured interval multiplied by the factor, never below the
+    minimum allowed by the API.
+    """
+
+    def __init__(
+        self,
+        min_factor=DEF_MIN_FACTOR,
+        max_factor=DEF_MAX_FACTOR,
+        increase_factor=DEF_INCREASE_FACTOR,
+        decrease_factor=DEF_DECREASE_FACTOR,
+    ):
+        if not 0 < min_factor <= 1 <= max_factor:
+            raise ValueError("Factors must satisfy 0 < min_factor <= 1 <= max_factor")
+        if increase_factor < 1 or not 0 < decrease_factor <= 1:
+            raise ValueError(
+                "Increase factor must be >= 1 and decrease factor between 0 and 1"
+            )
+        self._min_factor = min_factor
+        self._max_factor = max_factor
+        self._increase_factor = increase_factor
+        self._decrease_factor = decrease_factor
+        self._factors = {}
+        self._lock = Lock()
+
+    def observe(self, key, changed):
+        """Update the factor for key after an update with or without changes"""
+        with self._lock:
+            factor = self._factors.get(key, 1.0)
+            if changed:
+                factor = max(self._min_factor, factor * self._decrease_factor)
+            else:
+                factor = min(self._max_factor, factor * self._increase_factor)
+            self._factors[key] = factor
+
+    def factor(self, key):
+        return self._factors.get(key, 1.0)
+
+    def interval(self, key, base_interval, min_interval):
+        """Return the interval to use for key"""
+        return max(min_interval, base_interval * self.factor(key))
+
+    def reset(self, key=None):
+        with self._lock:
+            if key is None:
+                self._factors = {}
+            else:
+                self._factors.pop(key, None)
+
+
+def data_changed(old_data, new_data):
+    """Return True if new_data contains values different from old_data"""
+    if not old_data:
+        return bool(new_data)
+    for key, value in new_data.items():
+        if old_data.get(key) != value:
+            return True
+    return False
@@ -0,0 +1,61 @@
+"""Region of Tuya accounts, remembered to log in on the right host"""
+import hashlib
+import json
+import os
+from threading import Lock
+
+from tuyaha.locks import TuyaLockOwner
+
+# regions with a Home Assistant endpoint, probed concurrently at login
+REGIONS = ("us", "eu", "cn")
+
+
+def account_key(username, countryCode, bizType):
+    """Key of an account in the cache, the username is not stored as is"""
+    account = "{}:{}:{}".format(countryCode, bizType, username)
+    return hashlib.sha256(account.encode()).hexdigest()
+
+
+class TuyaRegionCache(TuyaLockOwner):
+    """Region of every account that logged in, optionally saved to a file"""
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = Lock()
+        self._regions = {}
+        if path and os.path.exists(path):
+            with open(path) as fh:
+                self._regions = json.load(fh)
+
+    def __reduce__(self):
+        if self is DEFAULT_REGION_CACHE:
+            # unpickled as the cache of the process, not as a copy
+            return "DEFAULT_REGION_CACHE"
+        return self.__class__, (self._path,), {"_regions": self._regions}
+
+    def get(self, username, countryCode, bizType):
+        return self._regions.get(account_key(username, countryCode, bizType))
+
+    def set(self, username, countryCode, bizType, region):
+        key = account_key(username, countryCode, bizType)
+        with self._lock:
+            if self._regions.get(key) == region:
+                return
+            self._regions[key] = region
+            self._save()
+
+    def discard(self, username, countryCode, bizType):
+        key = account_key(username, countryCode, bizType)
+        with self._lock:
+            if self._regions.pop(key, None) is not None:
+                self._save()
+
+    def _save(self):
+        if not self._path:
+            return
+        with open(self._path, "w") as fh:
+            json.dump(self._regions, fh)
+
+
+# shared by all the api instances of the process
+DEFAULT_REGION_CACHE = TuyaRegionCache()
@@ -0,0 +1,208 @@
+"""Activation of many scenes at once, with per scene results"""
+import asyncio
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from tuyaha.tuyaapi import TuyaFrequentlyInvokeException
+
+_LOGGER = logging.getLogger(__name__)
+
+# maximum number of scenes activated at the same time, kept low so a
+# batch of scenes does not trigger the API rate limit
+DEF_MAX_WORKERS = 4
+DEF_RETRIES = 2
+# seconds waited before the first retry, doubled at every retry
+DEF_RETRY_DELAY = 1.0
+
+# latency is the time from the first request to the last answer, in seconds
+TuyaSceneResult = namedtuple(
+    "TuyaSceneResult", ["scene_id", "success", "latency", "attempts", "error"]
+)
+
+# results and refreshed are dicts by scene and device id, duration in seconds
+TuyaSceneRun = namedtuple("TuyaSceneRun", ["results", "refreshed", "duration"])
+
+
+class TuyaSceneRunner:
+    """Activate scenes concurrently and report the outcome of each one.
+
+    Rate limit errors (FrequentlyInvoke) and connection errors are retried
+    with a growing delay. Commands rejected by the cloud, or failed with an
+    HTTP error, are not retried. After the activation, the devices changed
+    by the scenes can be refreshed with a query.
+    """
+
+    def __init__(
+        self,
+        api,
+        max_workers=DEF_MAX_WORKERS,
+        retries=DEF_RETRIES,
+        retry_delay=DEF_RETRY_DELAY,
+    ):
+        if max_workers < 1:
+            raise ValueError("At least one worker is required")
+        if retries < 0:
+            raise ValueError("Retries can not be negative")
+        self.api = api
+        self._max_workers = max_workers
+        self._retries = retries
+        self._retry_delay = retry_delay
+        self._executor = None
+
+    def close(self):
+        """Release the worker threads"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._max_workers,
+                thread_name_prefix="tuyaha-scene",
+            )
+        return self._executor
+
+    def _scene_ids(self, scenes):
+        # scenes can be given as TuyaScene objects or ids
+        ids = [getattr(scene, "obj_id", scene) for scene in scenes]
+        return list(dict.fromkeys(ids))
+
+    def _retry_wait(self, attempt):
+        return self._retry_delay * 2 ** (attempt - 1)
+
+    @staticmethod
+    def _failure(response):
+        if response is None:
+            return None
+        header = response["header"]
+        return header.get("msg") or header["code"]
+
+    def _activate(self, scene_id):
+        start = time.perf_counter()
+        error = None
+        attempt = 0
+        while True:
+            try:
+                success, response = self.api.device_control(
+                    scene_id, "turnOnOff", {"value": "1"}, retry=attempt
+                )
+            except TuyaFrequentlyInvokeException as ex:
+                success, response, error = False, None, str(ex)
+            else:
+                error = None if success else self._failure(response)
+            attempt += 1
+            # a command rejected by the cloud would be rejected again, only
+            # connection errors are returned without response
+            if success or response is not None:
+                break
+            if attempt > self._retries:
+                error = error or "no response"
+                break
+            time.sleep(self._retry_wait(attempt))
+        return TuyaSceneResult(
+            scene_id, success, time.perf_counter() - start, attempt, error
+        )
+
+    async def _async_activate(self, scene_id, semaphore):
+        start = time.perf_counter()
+        error = None
+        attempt = 0
+        while True:
+            try:
+                async with semaphore:
+                    success, response = await self.api.async_device_control(
+                        scene_id, "turnOnOff", {"value": "1"}, retry=attempt
+                    )
+            except TuyaFrequentlyInvokeException as ex:
+                success, response, error = False, None, str(ex)
+            else:
+                error = None if success else self._failure(response)
+            attempt += 1
+            # a command rejected by the cloud would be rejected again, only
+            # connection errors are returned without response
+            if success or response is not None:
+                break
+            if attempt > self._retries:
+                error = error or "no response"
+                break
+            await asyncio.sleep(self._retry_wait(attempt))
+        return TuyaSceneResult(
+            scene_id, success, time.perf_counter() - start, attempt, error
+        )
+
+    def _collect(self, activated):
+        results = {}
+        for result in activated:
+            if not result.success:
+                _LOGGER.warning(
+                    "scene %s failed after %d attempt(s): %s",
+                    result.scene_id,
+                    result.attempts,
+                    result.error,
+                )
+            results[result.scene_id] = result
+        return results
+
+    def _refresh(self, dev_id):
+        device = self.api.get_device_by_id(dev_id)
+        if device is None:
+            return False
+        # a query is sent even for a device never updated, update() would
+        # run a discovery of all the devices
+        try:
+            return bool(device._query())
+        except TuyaFrequentlyInvokeException as ex:
+            _LOGGER.warning("refresh of device %s failed: %s", dev_id, ex)
+            return False
+
+    async def _async_refresh(self, device):
+        try:
+            return bool(await device._async_query())
+        except TuyaFrequentlyInvokeException as ex:
+            _LOGGER.warning("refresh of device %s failed: %s", device.obj_id, ex)
+            return False
+
+    def run(self, scenes, refresh=None, refresh_delay=0.0):
+        """Activate scenes, then refresh the devices with ids in refresh.
+
+        Devices are queried even if their query interval has not passed, a
+        refreshed device is reported False when the query failed.
+        """
+        start = time.perf_counter()
+        executor = self._get_executor()
+        scene_ids = self._scene_ids(scenes)
+        futures = [executor.submit(self._activate, scene_id) for scene_id in scene_ids]
+        results = self._collect(future.result() for future in futures)
+        refreshed = {}
+        if refresh and any(result.success for result in results.values()):
+            if refresh_delay:
+                time.sleep(refresh_delay)
+            dev_ids = list(dict.fromkeys(refresh))
+            refreshed = dict(zip(dev_ids, executor.map(self._refresh, dev_ids)))
+        return TuyaSceneRun(results, refreshed, time.perf_counter() - start)
+
+    async def async_run(self, scenes, refresh=None, refresh_delay=0.0):
+        """Coroutine version of run, executed on the event loop"""
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self._max_workers)
+        scene_ids = self._scene_ids(scenes)
+        activated = await asyncio.gather(
+            *(self._async_activate(scene_id, semaphore) for scene_id in scene_ids)
+        )
+        results = self._collect(activated)
+        refreshed = {}
+        if refresh and any(result.success for result in results.values()):
+            if refresh_delay:
+                await asyncio.sleep(refresh_delay)
+            dev_ids = list(dict.fromkeys(refresh))
+            devices = [self.api.get_device_by_id(dev_id) for dev_id in dev_ids]
+            updated = await asyncio.gather(
+                *(self._async_refresh(device) for device in devices if device)
+            )
+            updated = iter(updated)
+            for dev_id, device in zip(dev_ids, devices):
+                refreshed[dev_id] = device is not None and next(updated)
+        return TuyaSceneRun(results, refreshed, time.perf_counter() - start)
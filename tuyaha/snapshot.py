@@ -0,0 +1,430 @@
+"""Columnar state snapshot for all the devices handled by the api"""
+from threading import Lock
+
+from tuyaha.devices.light import (
+    BRIGHTNESS_STD_RANGE,
+    COLTEMP_KELV_RANGE,
+    COLTEMP_SET_RANGE,
+    TuyaLight,
+)
+from tuyaha.locks import TuyaLockOwner
+
+# NumPy takes longer to import than the whole library, so it is imported
+# by the first snapshot instead of at import time
+np = None
+_numpy_checked = False
+
+# temperature values outside this range are supposed to be provided
+# multiplied by 100 (see TuyaClimate._set_decimal)
+TEMP_DECIMAL_RANGE = (-100, 500)
+TEMP_DECIMAL_DIVIDER = 100
+
+SNAPSHOT_COLUMNS = (
+    "id",
+    "dev_type",
+    "online",
+    "state",
+    "brightness",
+    "color_temp",
+    "hue",
+    "saturation",
+    "current_temperature",
+    "target_temperature",
+)
+
+
+def _state(value):
+    """Same conversion as TuyaDevice.state()"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value == "true"
+    return bool(value)
+
+
+def _read_light(data):
+    """Raw brightness, color temperature and hs color of a light.
+
+    Same values as TuyaLight.brightness() and hs_color() before scaling,
+    with the color support reported by the data.
+    """
+    color = data.get("color")
+    if data.get("color_mode") != "colour":
+        brightness = int(data.get("brightness", "-1"))
+        hs = (0.0, 0.0) if color else None
+    elif color:
+        brightness = int(color.get("brightness", "-1"))
+        hs = (
+            float(color.get("hue", 0.0)),
+            float(color.get("saturation", 0.0)) * 100,
+        )
+    else:
+        brightness = -1
+        hs = (0.0, 0.0)
+    return brightness, data.get("color_temp"), hs
+
+
+class TuyaStateColumns(TuyaLockOwner):
+    """Raw state of the discovered devices, kept as columns.
+
+    Columns are read from the discovery entries when they are loaded, then
+    only the rows of the devices reported by changed() are read again, by
+    the next snapshot. Light and climate columns are aligned with the
+    lights and climates row indexes.
+    """
+
+    def __init__(self, entries=()):
+        self._lock = Lock()
+        self.load(entries)
+
+    def load(self, entries):
+        """Read all the devices from discovery entries"""
+        entries = list(entries)
+        ids = []
+        dev_types = []
+        datas = []
+        lights = []
+        climates = []
+        for row, entry in enumerate(entries):
+            dev_type = entry.get("dev_type")
+            data = entry.get("data") or {}
+            ids.append(entry["id"])
+            dev_types.append(dev_type)
+            datas.append(data)
+            if not data:
+                continue
+            if dev_type == "light":
+                lights.append(row)
+            elif dev_type == "climate":
+                climates.append(row)
+        with self._lock:
+            self._entries = entries
+            self.ids = ids
+            self.dev_types = dev_types
+            self._rows = {dev_id: row for row, dev_id in enumerate(ids)}
+            self.lights = lights
+            self._light_pos = {row: pos for pos, row in enumerate(lights)}
+            self.climates = climates
+            self._climate_pos = {row: pos for pos, row in enumerate(climates)}
+            self.online = [data.get("online") for data in datas]
+            self.state = [_state(data.get("state")) for data in datas]
+            light_values = [_read_light(datas[row]) for row in lights]
+            self.brightness = [values[0] for values in light_values]
+            self.color_temp = [values[1] for values in light_values]
+            self.hs = [values[2] for values in light_values]
+            climate_data = [datas[row] for row in climates]
+            self.cur_temp = [data.get("current_temperature") for data in climate_data]
+            self.target_temp = [data.get("temperature") for data in climate_data]
+            self._changed = set()
+
+    def changed(self, dev_id):
+        """Read the row of the device again at the next snapshot"""
+        with self._lock:
+            self._changed.add(dev_id)
+
+    # called with the lock, return False when the rows of lights and
+    # climates have changed and all the devices must be read again
+    def _refresh(self):
+        for dev_id in self._changed:
+            row = self._rows.get(dev_id)
+            if row is None:
+                continue
+            data = self._entries[row].get("data") or {}
+            self.online[row] = data.get("online")
+            self.state[row] = _state(data.get("state"))
+            light_pos = self._light_pos.get(row)
+            climate_pos = self._climate_pos.get(row)
+            if light_pos is None and climate_pos is None:
+                if data and self.dev_types[row] in ("light", "climate"):
+                    return False
+                continue
+            if not data:
+                return False
+            if light_pos is not None:
+                brightness, color_temp, hs = _read_light(data)
+                self.brightness[light_pos] = brightness
+                self.color_temp[light_pos] = color_temp
+                self.hs[light_pos] = hs
+            else:
+                self.cur_temp[climate_pos] = data.get("current_temperature")
+                self.target_temp[climate_pos] = data.get("temperature")
+        self._changed = set()
+        return True
+
+    def _overrides(self, objects):
+        # settings learned or forced on the device objects already created
+        # (ranges, dividers, color support), by position in the light and
+        # climate columns, the defaults are used for the others
+        bright_range = {}
+        color_temp_range = {}
+        hs = {}
+        dividers = {}
+        for dev_id, device in objects.items():
+            row = self._rows.get(dev_id)
+            if row is None:
+                continue
+            pos = self._light_pos.get(row)
+            if pos is not None:
+                bright_range[pos] = device._brightness_range()
+                color_temp_range[pos] = device.color_temp_range
+                value = device.hs_color()
+                hs[pos] = None if value is None else tuple(map(float, value))
+            pos = self._climate_pos.get(row)
+            if pos is not None:
+                dividers[pos] = (device._divider, device._ct_divider)
+        return bright_range, color_temp_range, hs, dividers
+
+    def snapshot(self, objects=None, use_numpy=None, dev_type=None):
+        """Return the columns scaled like the per device methods"""
+        numpy = _load_numpy()
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        elif use_numpy and numpy is None:
+            raise ImportError("NumPy is required to build a vectorized snapshot")
+
+        objects = objects or {}
+        with self._lock:
+            reload = self._changed and not self._refresh()
+        if reload:
+            self.load(self._entries)
+        with self._lock:
+            overrides = self._overrides(objects)
+            if use_numpy:
+                columns, learned = _compute_numpy(self, *overrides)
+                columns["id"] = np.array(self.ids, dtype=object)
+                columns["dev_type"] = np.array(self.dev_types, dtype=object)
+                columns["online"] = np.fromiter(
+                    map(bool, self.online), dtype=bool, count=len(self.online)
+                )
+                columns["state"] = np.array(self.state, dtype=object)
+            else:
+                columns, learned = _compute_python(self, *overrides)
+                columns["id"] = list(self.ids)
+                columns["dev_type"] = list(self.dev_types)
+                columns["online"] = list(self.online)
+                columns["state"] = list(self.state)
+            rows = None
+            if dev_type is not None:
+                types = self.dev_types
+                rows = [row for row, typ in enumerate(types) if typ == dev_type]
+
+        # keep the divider detected from values like the per device methods
+        # do, devices created later detect it again from their data
+        for row in learned:
+            device = objects.get(columns["id"][row])
+            if device is not None:
+                device._divider = TEMP_DECIMAL_DIVIDER
+
+        snapshot = {}
+        for name in SNAPSHOT_COLUMNS:
+            column = columns[name]
+            if rows is not None:
+                if use_numpy:
+                    column = column[np.array(rows, dtype=np.intp)]
+                else:
+                    column = [column[row] for row in rows]
+            snapshot[name] = column
+        return snapshot
+
+
+def _out_of_range(val):
+    if val is None:
+        return False
+    return val > TEMP_DECIMAL_RANGE[1] or val < TEMP_DECIMAL_RANGE[0]
+
+
+def _scale_py(values, overrides, default, dst):
+    """TuyaLight._scale of every value, rounded, None stays None"""
+    dst_lo, dst_span = dst[0], dst[1] - dst[0]
+    src_lo, src_span = default[0], default[1] - default[0]
+    scaled = [
+        None
+        if val is None
+        else dst_lo
+        if val < 0
+        else round((val - src_lo) / src_span * dst_span + dst_lo)
+        for val in values
+    ]
+    # devices with their own range, only the ones already created
+    for pos, src in overrides.items():
+        if values[pos] is not None:
+            scaled[pos] = round(TuyaLight._scale(values[pos], src, dst))
+    return scaled
+
+
+def _scatter(column, rows, values):
+    for row, val in zip(rows, values):
+        column[row] = val
+
+
+def _compute_python(raw, bright_range, color_temp_range, hs_overrides, dividers):
+    count = len(raw.ids)
+    lights = raw.lights
+    brightness = [None] * count
+    color_temp = [None] * count
+    hue = [None] * count
+    saturation = [None] * count
+    _scatter(
+        brightness,
+        lights,
+        _scale_py(
+            raw.brightness, bright_range, BRIGHTNESS_STD_RANGE, BRIGHTNESS_STD_RANGE
+        ),
+    )
+    _scatter(
+        color_temp,
+        lights,
+        _scale_py(
+            raw.color_temp, color_temp_range, COLTEMP_SET_RANGE, COLTEMP_KELV_RANGE
+        ),
+    )
+    hs = raw.hs
+    if hs_overrides:
+        hs = list(hs)
+        for pos, value in hs_overrides.items():
+            hs[pos] = value
+    for row, value in zip(lights, hs):
+        if value is not None:
+            hue[row], saturation[row] = value
+
+    cur_temp = [None] * count
+    target_temp = [None] * count
+    learned = []
+    no_divider = (0, 0)
+    for pos, row in enumerate(raw.climates):
+        cur, tgt = raw.cur_temp[pos], raw.target_temp[pos]
+        divider, ct_divider = dividers.get(pos, no_divider)
+        cur_out = ct_divider == 0 and _out_of_range(cur)
+        detected = divider == 0 and (cur_out or _out_of_range(tgt))
+        if detected:
+            learned.append(row)
+        cur_div = ct_divider or divider or (TEMP_DECIMAL_DIVIDER if cur_out else 1)
+        tgt_div = divider or (TEMP_DECIMAL_DIVIDER if detected else 1)
+        if tgt is not None:
+            target_temp[row] = round(float(tgt / tgt_div), 2)
+        if cur is not None:
+            cur_temp[row] = round(float(cur / cur_div), 2)
+        else:
+            cur_temp[row] = target_temp[row]
+
+    columns = {
+        "brightness": brightness,
+        "color_temp": color_temp,
+        "hue": hue,
+        "saturation": saturation,
+        "current_temperature": cur_temp,
+        "target_temperature": target_temp,
+    }
+    return columns, learned
+
+
+def _to_float_array(values):
+    return np.array(
+        [np.nan if val is None else val for val in values], dtype=np.float64
+    )
+
+
+def _scale_np(val, overrides, default, dst):
+    src = np.empty((len(val), 2))
+    src[:] = default
+    # devices with their own range, only the ones already created
+    for pos, custom in overrides.items():
+        src[pos] = custom
+    src_lo, src_hi = src[:, 0], src[:, 1]
+    res = (val - src_lo) / (src_hi - src_lo) * (dst[1] - dst[0]) + dst[0]
+    res = np.where(val < 0, dst[0], res)
+    return np.round(res)
+
+
+def _compute_numpy(raw, bright_range, color_temp_range, hs_overrides, dividers):
+    count = len(raw.ids)
+    brightness = np.full(count, np.nan)
+    color_temp = np.full(count, np.nan)
+    hue = np.full(count, np.nan)
+    saturation = np.full(count, np.nan)
+    if raw.lights:
+        idx = np.array(raw.lights, dtype=np.intp)
+        bright = np.array(raw.brightness, dtype=np.float64)
+        brightness[idx] = _scale_np(
+            bright, bright_range, BRIGHTNESS_STD_RANGE, BRIGHTNESS_STD_RANGE
+        )
+        temp = _to_float_array(raw.color_temp)
+        with np.errstate(invalid="ignore"):
+            color_temp[idx] = _scale_np(
+                temp, color_temp_range, COLTEMP_SET_RANGE, COLTEMP_KELV_RANGE
+            )
+        nan_hs = (np.nan, np.nan)
+        hs = np.array([val or nan_hs for val in raw.hs], dtype=np.float64)
+        for pos, value in hs_overrides.items():
+            hs[pos] = value or nan_hs
+        hue[idx] = hs[:, 0]
+        saturation[idx] = hs[:, 1]
+
+    cur_temp = np.full(count, np.nan)
+    target_temp = np.full(count, np.nan)
+    learned = []
+    if raw.climates:
+        idx = np.array(raw.climates, dtype=np.intp)
+        cur = _to_float_array(raw.cur_temp)
+        tgt = _to_float_array(raw.target_temp)
+        divider = np.zeros(len(idx))
+        ct_divider = np.zeros(len(idx))
+        for pos, (value, ct_value) in dividers.items():
+            divider[pos] = value
+            ct_divider[pos] = ct_value
+        # comparisons with NaN are False, so missing values are never
+        # considered as decimal values
+        with np.errstate(invalid="ignore"):
+            cur_out = (ct_divider == 0) & (
+                (cur > TEMP_DECIMAL_RANGE[1]) | (cur < TEMP_DECIMAL_RANGE[0])
+            )
+            tgt_out = (tgt > TEMP_DECIMAL_RANGE[1]) | (tgt < TEMP_DECIMAL_RANGE[0])
+        detected = (divider == 0) & (cur_out | tgt_out)
+        auto_cur = np.where(cur_out, TEMP_DECIMAL_DIVIDER, 1)
+        cur_div = np.where(
+            ct_divider > 0, ct_divider, np.where(divider > 0, divider, auto_cur)
+        )
+        tgt_div = np.where(
+            divider > 0, divider, np.where(detected, TEMP_DECIMAL_DIVIDER, 1)
+        )
+        tgt_val = np.round(tgt / tgt_div, 2)
+        cur_val = np.round(cur / cur_div, 2)
+        target_temp[idx] = tgt_val
+        cur_temp[idx] = np.where(np.isnan(cur), tgt_val, cur_val)
+        learned = idx[detected].tolist()
+
+    columns = {
+        "brightness": brightness,
+        "color_temp": color_temp,
+        "hue": hue,
+        "saturation": saturation,
+        "current_temperature": cur_temp,
+        "target_temperature": target_temp,
+    }
+    return columns, learned
+
+
+def _load_numpy():
+    global np, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+
+            np = numpy
+        except ImportError:
+            pass
+        _numpy_checked = True
+    return np
+
+
+def build_snapshot(entries, objects=None, use_numpy=None):
+    """Return a dict of columns with the scaled state of the given devices.
+
+    entries are discovery entries (id, dev_type and data) and objects the
+    device objects already created, by id. Values are the same returned by
+    the per device methods (brightness(), color_temp(), hs_color(),
+    current_temperature(), ...). Columns are NumPy arrays when NumPy is
+    available (missing values are NaN), lists otherwise (missing values
+    are None).
+    """
+    return TuyaStateColumns(entries).snapshot(objects, use_numpy)
@@ -0,0 +1,293 @@
+"""Poll many accounts from worker processes.
+
+Accounts are shared out among the workers, one per process by default.
+A worker polls each of its accounts with a TuyaApi using its own session.
+Workers send the discovered devices to the parent through a pipe, encoded
+with the fastest JSON codec available, and the parent exposes them as
+read-only device objects.
+"""
+import logging
+import multiprocessing
+import time
+from collections import namedtuple
+from multiprocessing.connection import wait
+from threading import Lock, Thread
+
+from tuyaha.codec import get_default_codec
+from tuyaha.devices.factory import get_tuya_device
+from tuyaha.tuyaapi import MIN_DISCOVERY_INTERVAL, TuyaApi
+
+_LOGGER = logging.getLogger(__name__)
+
+TuyaAccount = namedtuple(
+    "TuyaAccount", ["username", "password", "countryCode", "bizType", "region"]
+)
+TuyaAccount.__new__.__defaults__ = ("", "us")
+
+# seconds waited by the parent for a message before checking if it must stop
+READ_TIMEOUT = 1.0
+
+MSG_DEVICES = "devices"
+MSG_ERROR = "error"
+
+
+def _worker_main(accounts, conn, poll_interval, stop_event):
+    codec = get_default_codec()
+
+    def send(index, kind, value):
+        conn.send_bytes(codec.dumps({"index": index, "kind": kind, "value": value}))
+
+    # accounts are (index, account) tuples, each one with its own session
+    apis = {}
+    for index, account in accounts:
+        api = TuyaApi(shared_session=False)
+        api.discovery_interval = poll_interval
+        apis[index] = api
+    logged = set()
+    while not stop_event.is_set():
+        for index, account in accounts:
+            if stop_event.is_set():
+                break
+            api = apis[index]
+            try:
+                if index not in logged:
+                    api.init(*account)
+                    logged.add(index)
+                    devices = api.discovery()
+                else:
+                    devices = api.poll_devices_update()
+                if devices:
+                    send(index, MSG_DEVICES, devices)
+            except Exception as ex:
+                send(index, MSG_ERROR, "{}: {}".format(type(ex).__name__, ex))
+        stop_event.wait(poll_interval)
+    conn.close()
+
+
+class TuyaReadOnlyApi(TuyaApi):
+    """Api used by device views, it only provides the received data.
+
+    Requests are not sent: a query returns the data received from the
+    worker, every other command raises TuyaReadOnlyException.
+    """
+
+    def __init__(self, supervisor, index):
+        super().__init__(shared_session=False)
+        self._supervisor = supervisor
+        self._index = index
+
+    def _discover(self):
+        return self._supervisor.shard_devices(self._index), False
+
+    async def _async_discover(self):
+        return self._discover()
+
+    def get_all_devices(self):
+        return self._supervisor.get_all_devices(self._index)
+
+    def get_device_by_id(self, dev_id):
+        return self._supervisor.get_device_by_id(dev_id, self._index)
+
+    def device_state(self, dev_id):
+        device = self._supervisor.get_device_by_id(dev_id, self._index)
+        return device.data if device is not None else None
+
+    # the data is local, it can be read at any time
+    def effective_query_interval(self, dev_id):
+        return 0
+
+    def _request(
+        self, name, namespace, devId=None, payload=None, lock_contended=False, retry=0
+    ):
+        if name != "QueryDevice":
+            raise TuyaReadOnlyException(
+                "device {} is a read-only view of a worker process".format(devId)
+            )
+        data = self.device_state(devId)
+        if data is None:
+            return None
+        return {"header": {"code": "SUCCESS"}, "payload": {"data": dict(data)}}
+
+    async def _async_request(
+        self, name, namespace, devId=None, payload=None, lock_contended=False, retry=0
+    ):
+        return self._request(name, namespace, devId, payload, lock_contended, retry)
+
+
+class TuyaSupervisor:
+    """Shard accounts across worker processes and aggregate their devices.
+
+    workers is the number of processes, by default one per account. With
+    less workers than accounts, each worker polls several accounts in turn.
+    A device reported by several accounts has a view for each of them.
+    """
+
+    def __init__(self, accounts, poll_interval=60.0, mp_context=None, workers=None):
+        if poll_interval < MIN_DISCOVERY_INTERVAL:
+            raise ValueError(
+                f"Poll interval below {MIN_DISCOVERY_INTERVAL} seconds is invalid"
+            )
+        if workers is not None and workers < 1:
+            raise ValueError("At least one worker is required")
+        self._accounts = [TuyaAccount(*account) for account in accounts]
+        self._workers = min(workers or len(self._accounts), len(self._accounts))
+        self._poll_interval = poll_interval
+        self._context = mp_context or multiprocessing.get_context()
+        self._lock = Lock()
+        self._shards = [[] for _ in self._accounts]
+        # views by (account index, device id), with an api by account index
+        self._views = {}
+        self._apis = {}
+        self._errors = {}
+        self._last_update = {}
+        self._processes = []
+        self._conns = {}
+        self._stop_event = None
+        self._reader = None
+
+    def start(self):
+        if self._processes:
+            return
+        self._stop_event = self._context.Event()
+        accounts = list(enumerate(self._accounts))
+        for worker in range(self._workers):
+            parent_conn, child_conn = self._context.Pipe(duplex=False)
+            process = self._context.Process(
+                target=_worker_main,
+                args=(
+                    accounts[worker :: self._workers],
+                    child_conn,
+                    self._poll_interval,
+                    self._stop_event,
+                ),
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self._processes.append(process)
+            self._conns[parent_conn] = worker
+        self._reader = Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def stop(self, timeout=None):
+        if not self._processes:
+            return
+        self._stop_event.set()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._reader.join(timeout)
+        self._processes = []
+        self._conns = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _read_loop(self):
+        codec = get_default_codec()
+        while self._conns and not self._stop_event.is_set():
+            for conn in wait(list(self._conns), READ_TIMEOUT):
+                try:
+                    message = codec.loads(conn.recv_bytes())
+                except (EOFError, OSError):
+                    del self._conns[conn]
+                    continue
+                index = message["index"]
+                if message["kind"] == MSG_DEVICES:
+                    self._load_shard(index, message["value"])
+                else:
+                    _LOGGER.warning(
+                        "worker for account %s error: %s",
+                        self._accounts[index].username,
+                        message["value"],
+                    )
+                    with self._lock:
+                        self._errors[index] = message["value"]
+
+    def _load_shard(self, index, devices):
+        with self._lock:
+            for device in devices:
+                view = self._views.get((index, device["id"]))
+                if view is None:
+                    api = self._apis.get(index)
+                    if api is None:
+                        api = self._apis[index] = TuyaReadOnlyApi(self, index)
+                    for view in get_tuya_device(device, api):
+                        self._views[index, view.object_id()] = view
+                else:
+                    # keep the view, so values learned by the device are kept
+                    view.data = device.get("data")
+                    view._invalidate_capabilities()
+            removed = {device["id"] for device in self._shards[index]}
+            removed.difference_update(device["id"] for device in devices)
+            for dev_id in removed:
+                self._views.pop((index, dev_id), None)
+            self._shards[index] = devices
+            self._errors.pop(index, None)
+            self._last_update[index] = time.time()
+
+    def shard_devices(self, index):
+        with self._lock:
+            return self._shards[index]
+
+    def wait_ready(self, timeout=None):
+        """Wait until every worker sent devices or an error"""
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                ready = all(
+                    index in self._last_update or index in self._errors
+                    for index in range(len(self._accounts))
+                )
+            if ready:
+                return True
+            if end is not None and time.monotonic() >= end:
+                return False
+            time.sleep(0.05)
+
+    def errors(self):
+        """Last error reported by each worker, keyed by account username"""
+        with self._lock:
+            return {
+                self._accounts[index].username: error
+                for index, error in self._errors.items()
+            }
+
+    def get_all_devices(self, index=None):
+        """Views of all the devices, or of the devices of an account index"""
+        with self._lock:
+            if index is None:
+                return list(self._views.values())
+            return [
+                view for (owner, _), view in self._views.items() if owner == index
+            ]
+
+    def get_devices_by_type(self, dev_type):
+        return [
+            device
+            for device in self.get_all_devices()
+            if device.device_type() == dev_type
+        ]
+
+    def get_device_by_id(self, dev_id, index=None):
+        """View of a device reported by an account index.
+
+        Without index, the view of the first account reporting the device.
+        """
+        with self._lock:
+            if index is not None:
+                return self._views.get((index, dev_id))
+            for index in range(len(self._accounts)):
+                view = self._views.get((index, dev_id))
+                if view is not None:
+                    return view
+            return None
+
+
+class TuyaReadOnlyException(Exception):
+    pass
@@ -0,0 +1,86 @@
+"""Hooks called around every request sent to Tuya cloud"""
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class TuyaRequestTrace:
+    """Information about a single request, filled while it is processed"""
+
+    __slots__ = (
+        "action",
+        "namespace",
+        "dev_id",
+        "request_size",
+        "response_size",
+        "status",
+        "result_code",
+        "error",
+        "retry",
+        "lock_contended",
+        "start_time",
+        "duration",
+        "context",
+    )
+
+    def __init__(self, action, namespace, dev_id, request_size, retry, lock_contended):
+        self.action = action
+        self.namespace = namespace
+        self.dev_id = dev_id
+        self.request_size = request_size
+        self.response_size = None
+        # HTTP status code, None if the request did not get a response
+        self.status = None
+        # code returned in the response header, e.g. SUCCESS or FrequentlyInvoke
+        self.result_code = None
+        self.error = None
+        self.retry = retry
+        self.lock_contended = lock_contended
+        self.start_time = time.perf_counter()
+        self.duration = None
+        # free slot that hooks can use to keep their own state (e.g. a span)
+        self.context = None
+
+    def __repr__(self):
+        return (
+            "<TuyaRequestTrace {} {} dev={} status={} code={} duration={}>".format(
+                self.namespace,
+                self.action,
+                self.dev_id,
+                self.status,
+                self.result_code,
+                self.duration,
+            )
+        )
+
+
+class TuyaTraceHooks:
+    """Base class for request hooks, subclasses override the needed methods"""
+
+    def on_request_start(self, trace):
+        pass
+
+    def on_request_end(self, trace):
+        pass
+
+
+def trace_start(
+    hooks, action, namespace, dev_id, request_size, retry=0, lock_contended=False
+):
+    trace = TuyaRequestTrace(
+        action, namespace, dev_id, request_size, retry, lock_contended
+    )
+    try:
+        hooks.on_request_start(trace)
+    except Exception:
+        _LOGGER.exception("request start hook failed")
+    return trace
+
+
+def trace_end(hooks, trace):
+    trace.duration = time.perf_counter() - trace.start_time
+    try:
+        hooks.on_request_end(trace)
+    except Exception:
+        _LOGGER.exception("request end hook failed")
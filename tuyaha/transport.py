@@ -0,0 +1,189 @@
+"""Request sessions used instead of requests.Session to record or replay
+the responses of Tuya cloud, e.g. to run the CLI offline"""
+import json
+from itertools import cycle
+from urllib.parse import urlparse
+
+import requests
+
+AUTH_RESPONSE = {
+    "access_token": "EUreplay0000000000000000",
+    "refresh_token": "EUreplay0000000000000000",
+    "expires_in": 864000,
+}
+
+SUCCESS_RESPONSE = {"header": {"code": "SUCCESS"}, "payload": {}}
+
+
+class TuyaReplayResponse:
+    """Minimal replacement of requests.Response"""
+
+    def __init__(self, body, status_code=200):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.content = body
+        self.status_code = status_code
+        self.ok = status_code < 400
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.exceptions.HTTPError(
+                "{} replayed error".format(self.status_code), response=self
+            )
+
+
+def _request_key(url, data):
+    path = urlparse(url).path.rsplit("/", 1)[-1]
+    if path != "skill":
+        return path, None, None
+    if isinstance(data, bytes):
+        data = json.loads(data)
+    name = data["header"]["name"]
+    return path, name, data["payload"].get("devId")
+
+
+def synthetic_recording(count):
+    """Return a recording with a discovery of count devices of mixed types"""
+    devices = []
+    for i in range(count):
+        kind = i % 4
+        dev_id = "replay{:06d}".format(i)
+        if kind == 0:
+            device = {
+                "dev_type": "light",
+                "data": {
+                    "online": True,
+                    "state": "true",
+                    "brightness": "128",
+                    "color_mode": "colour",
+                    "color": {"hue": 120, "saturation": 0.5, "brightness": 200},
+                    "color_temp": 5000,
+                },
+            }
+        elif kind == 1:
+            device = {
+                "dev_type": "climate",
+                "data": {
+                    "online": True,
+                    "state": "true",
+                    "current_temperature": 2150,
+                    "temperature": 2200,
+                    "mode": "hot",
+                    "temp_unit": "CELSIUS",
+                },
+            }
+        elif kind == 2:
+            device = {"dev_type": "switch", "data": {"online": True, "state": True}}
+        else:
+            device = {
+                "dev_type": "fan",
+                "data": {
+                    "online": True,
+                    "state": "true",
+                    "speed": "1",
+                    "speed_level": 3,
+                },
+            }
+        device.update(
+            id=dev_id,
+            name="{} {}".format(device["dev_type"], i),
+            ha_type=device["dev_type"],
+            icon="",
+        )
+        devices.append(device)
+    entries = [
+        {"key": ["auth.do", None, None], "status": 200, "body": AUTH_RESPONSE},
+        {
+            "key": ["skill", "Discovery", None],
+            "status": 200,
+            "body": {"header": {"code": "SUCCESS"}, "payload": {"devices": devices}},
+        },
+    ]
+    for device in devices:
+        entries.append(
+            {
+                "key": ["skill", "QueryDevice", device["id"]],
+                "status": 200,
+                "body": {
+                    "header": {"code": "SUCCESS"},
+                    "payload": {"data": device["data"]},
+                },
+            }
+        )
+    return entries
+
+
+class TuyaReplaySession:
+    """Answer requests with recorded responses, without network access.
+
+    Responses recorded for the same request are returned in a loop.
+    Control commands that were not recorded succeed with an empty payload.
+    """
+
+    def __init__(self, entries):
+        responses = {}
+        for entry in entries:
+            key = tuple(entry["key"])
+            responses.setdefault(key, []).append(
+                (entry["body"], entry.get("status", 200))
+            )
+        self._responses = {key: cycle(val) for key, val in responses.items()}
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as fh:
+            return cls(json.load(fh))
+
+    def _respond(self, url, data):
+        key = _request_key(url, data)
+        responses = self._responses.get(key)
+        if responses is None and key[0] == "access.do":
+            responses = self._responses.get(("auth.do", None, None))
+        if responses is None:
+            responses = self._responses.get((key[0], key[1], None))
+        if responses is None:
+            if key[0] != "skill":
+                return TuyaReplayResponse(AUTH_RESPONSE)
+            return TuyaReplayResponse(SUCCESS_RESPONSE)
+        body, status = next(responses)
+        return TuyaReplayResponse(body, status)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self._respond(url, data if json is None else json)
+
+    def get(self, url, **kwargs):
+        return self._respond(url, None)
+
+    def close(self):
+        pass
+
+
+class TuyaRecordingSession(requests.Session):
+    """requests.Session that keeps the responses to save them for replay"""
+
+    def __init__(self):
+        super().__init__()
+        self.entries = []
+
+    def request(self, method, url, data=None, json=None, **kwargs):
+        response = super().request(method, url, data=data, json=json, **kwargs)
+        key = _request_key(url, data if json is None else json)
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+        if key[0] != "skill" and isinstance(body, dict) and "access_token" in body:
+            # never store the tokens of the account, only their region prefix
+            token = body["access_token"][0:2] + AUTH_RESPONSE["access_token"][2:]
+            body = dict(body, access_token=token, refresh_token=token)
+        self.entries.append(
+            {"key": list(key), "status": response.status_code, "body": body}
+        )
+        return response
+
+    def save(self, path):
+        with open(path, "w") as fh:
+            json.dump(self.entries, fh, indent=1)
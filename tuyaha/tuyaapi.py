@@ -1,13 +1,29 @@
 import logging
+import os
 import time
+import weakref
 
 import requests
-from datetime import datetime
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 from requests.exceptions import ConnectionError as RequestsConnectionError
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError as RequestsHTTPError
-from threading import Lock
+from threading import Lock, RLock
 
-from tuyaha.devices.factory import get_tuya_device
+from tuyaha.codec import TuyaJsonCodec, build_request, get_default_codec
+from tuyaha.devices.collection import TuyaDeviceList
+from tuyaha.history import TuyaHistoryRecorder
+from tuyaha.polling import DISCOVERY_KEY, TuyaAdaptivePolling, data_changed
+from tuyaha.region import DEFAULT_REGION_CACHE, REGIONS, TuyaRegionCache
+from tuyaha.snapshot import TuyaStateColumns
+from tuyaha.tracing import TuyaTraceHooks, trace_end, trace_start
+
+# asyncio and aiohttp are imported by the first async request, sync
+# users do not pay for their import
+aiohttp = None
+_aiohttp_checked = False
 
 TUYACLOUDURL = "https://px1.tuya{}.com"
 DEFAULTREGION = "us"
@@ -26,9 +42,47 @@ DEF_QUERY_INTERVAL = 30.0
 
 REFRESHTIME = 60 * 60 * 12
 
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Number of FrequentlyInvoke errors kept for rate limit introspection
+MAX_THROTTLE_EVENTS = 20
+
+TuyaThrottleEvent = namedtuple(
+    "TuyaThrottleEvent", ["time", "action", "dev_id", "interval", "message"]
+)
+
 _LOGGER = logging.getLogger(__name__)
 lock = Lock()
 
+# attributes of the session saved with a pickled TuyaApi, the password is
+# not saved
+SESSION_STATE = (
+    "username",
+    "countryCode",
+    "bizType",
+    "accessToken",
+    "refreshToken",
+    "expireTime",
+    "region",
+)
+
+# TuyaApi attributes that belong to the process and are not pickled
+_PROCESS_STATE = (
+    "_requestSession",
+    "_async_session",
+    "state_lock",
+    "_token_lock",
+    "_trace_hooks",
+    "_state_listeners",
+    "_devices",
+    "_session",
+    "_discovery_lock",
+    "_state_columns",
+)
+
+# api instances reset in the child process after fork
+_instances = weakref.WeakSet()
+
 
 class TuyaSession:
 
@@ -47,15 +101,148 @@ SESSION = TuyaSession()
 
 
 class TuyaApi:
+    """Client of Tuya Home Assistant cloud API.
+
+    Concurrency contract: a TuyaApi and its devices can be used from many
+    threads at the same time.
+
+    - discovery runs once at a time for the process (module level lock),
+      concurrent callers wait and then get the cached result. An api with
+      its own session (shared_session=False) has its own discovery lock.
+    - the discovery cache and the device list are replaced together under
+      state_lock. Readers (get_all_devices, get_device_by_id,
+      get_devices_by_type) never lock and see the old or the new device
+      set, never a mix of them in a single call. Device objects are created
+      on first access, once per device list.
+    - optimistic device updates are written under state_lock. An update
+      made on a device object replaced by discovery is forwarded to the
+      new object, and updates made while discovery was running are kept
+      over the values it returned, so they are never lost.
+    - access token is checked and refreshed by one thread at a time, the
+      other threads wait and use the new token.
+    - a device runs one update() at a time, concurrent calls wait and
+      then use the data cached by the first one.
+    - state listeners and trace hooks are called without holding any
+      library lock, from the thread that caused the change.
+    - after os.fork() the child gets new locks and connection pools, so
+      a logged in api can be forked and used by the child.
 
-    def __init__(self):
+    The async_* methods run on the event loop. They send requests with
+    aiohttp when it is installed (and the default requests session is
+    used), otherwise in the default executor. async_discovery never waits
+    for a discovery running elsewhere, it returns the cached devices.
+    """
+
+    def __init__(self, shared_session=True):
+        self._use_session(shared_session)
         self._requestSession = None
+        self._async_session = None
         self._discovered_devices = None
+        # guards the replacement of device cache against write-back
+        self.state_lock = RLock()
+        self._token_lock = Lock()
         self._last_discovery = None
         self._force_discovery = False
         self._discovery_interval = DEF_DISCOVERY_INTERVAL
         self._query_interval = DEF_QUERY_INTERVAL
         self._discovery_fail_count = 0
+        self._json_codec = get_default_codec()
+        self._throttle_events = deque(maxlen=MAX_THROTTLE_EVENTS)
+        self._history = None
+        self._adaptive_polling = None
+        self._trace_hooks = None
+        self._devices = TuyaDeviceList()
+        # authoritative data of every device, shared by discovery cache
+        # entries and device objects
+        self._device_states = {}
+        self._state_listeners = []
+        # raw columns of state_snapshot, created by the first snapshot
+        self._state_columns = None
+        self._region_cache = DEFAULT_REGION_CACHE
+        self._probe_region = False
+        _instances.add(self)
+
+    # A pickled api keeps the login (its session), the discovery
+    # cache, the device objects already created with the values they have
+    # learned (e.g. temperature divider) and the polling state, so it can
+    # be used without login and discovery once unpickled.
+    # The password is not pickled: the unpickled api uses the saved tokens
+    # and refreshes them, init() must be called again with the credentials
+    # when a new login is needed (e.g. the refresh token is not valid).
+    # Request session, trace hooks and state listeners are not pickled,
+    # a new requests session is used.
+    def __getstate__(self):
+        with self.state_lock:
+            state = self.__dict__.copy()
+            for key in _PROCESS_STATE:
+                del state[key]
+            state["session"] = {
+                key: getattr(self._session, key) for key in SESSION_STATE
+            }
+            state["shared_session"] = self._session is SESSION
+            state["devices"] = {
+                device.object_id(): device for device in self._devices.created()
+            }
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        session = state.pop("session")
+        devices = state.pop("devices")
+        shared_session = state.pop("shared_session", True)
+        self.__dict__.update(state)
+        self._use_session(shared_session)
+        for key, value in session.items():
+            setattr(self._session, key, value)
+        self._requestSession = requests.Session()
+        self._async_session = None
+        self.state_lock = RLock()
+        self._token_lock = Lock()
+        self._trace_hooks = None
+        self._state_listeners = []
+        self._state_columns = None
+        self._devices = TuyaDeviceList(self._discovered_devices or (), self)
+        # devices may not be unpickled yet when the api is pickled with
+        # one of them, so their ids are stored with them
+        for dev_id, device in devices.items():
+            if self._devices.entry(dev_id) is not None:
+                self._devices.adopt(device, dev_id)
+        self._session.devices = self._devices
+        _instances.add(self)
+
+    # the login is kept in the module level SESSION shared by the apis of
+    # the process, an api with its own session can use another account in
+    # the same process
+    def _use_session(self, shared_session):
+        if shared_session:
+            self._session = SESSION
+            self._discovery_lock = lock
+        else:
+            self._session = TuyaSession()
+            self._discovery_lock = Lock()
+
+    # called in the child process after fork: locks may have been held by
+    # threads of the parent and connections must not be shared with it
+    def _after_fork(self):
+        self.state_lock = RLock()
+        self._token_lock = Lock()
+        self._discovery_lock = lock if self._session is SESSION else Lock()
+        if isinstance(self._requestSession, requests.Session):
+            _reset_connection_pools(self._requestSession)
+        # bound to the event loop of the parent
+        self._async_session = None
+        self._devices._after_fork()
+        for device in self._devices.created():
+            device._after_fork()
+        features = (
+            self._history,
+            self._adaptive_polling,
+            self._region_cache,
+            self._state_columns,
+        )
+        for feature in features:
+            if feature is not None:
+                feature._after_fork()
 
     @property
     def discovery_interval(self):
@@ -83,31 +270,246 @@ class TuyaApi:
             )
         self._query_interval = val
 
-    def init(self, username, password, countryCode, bizType="", region=DEFAULTREGION):
-        SESSION.username = username
-        SESSION.password = password
-        SESSION.countryCode = countryCode
-        SESSION.bizType = bizType
-        SESSION.region = region
+    @property
+    def json_codec(self):
+        """The codec used to encode requests and decode responses"""
+        return self._json_codec
 
-        self._requestSession = requests.Session()
+    @json_codec.setter
+    def json_codec(self, codec):
+        if not isinstance(codec, TuyaJsonCodec):
+            raise ValueError("JSON codec must be a TuyaJsonCodec")
+        self._json_codec = codec
+
+    @property
+    def trace_hooks(self):
+        """The hooks called around every cloud request, None if disabled"""
+        return self._trace_hooks
+
+    @trace_hooks.setter
+    def trace_hooks(self, hooks):
+        if hooks is not None and not isinstance(hooks, TuyaTraceHooks):
+            raise ValueError("Trace hooks must be a TuyaTraceHooks or None")
+        self._trace_hooks = hooks
+
+    @property
+    def region_cache(self):
+        """The cache of account regions used at login, None if disabled"""
+        return self._region_cache
+
+    @region_cache.setter
+    def region_cache(self, cache):
+        if cache is not None and not isinstance(cache, TuyaRegionCache):
+            raise ValueError("Region cache must be a TuyaRegionCache or None")
+        self._region_cache = cache
+
+    @property
+    def history(self):
+        """The recorder of device state changes, None if disabled"""
+        return self._history
+
+    @history.setter
+    def history(self, recorder):
+        if recorder is not None and not isinstance(recorder, TuyaHistoryRecorder):
+            raise ValueError("History must be a TuyaHistoryRecorder or None")
+        self._history = recorder
+
+    @property
+    def adaptive_polling(self):
+        """The policy used to adapt poll intervals, None if disabled"""
+        return self._adaptive_polling
+
+    @adaptive_polling.setter
+    def adaptive_polling(self, policy):
+        if policy is not None and not isinstance(policy, TuyaAdaptivePolling):
+            raise ValueError("Adaptive polling must be a TuyaAdaptivePolling or None")
+        self._adaptive_polling = policy
+
+    def effective_discovery_interval(self):
+        """The discovery interval adapted to the observed change rate"""
+        if self._adaptive_polling is None:
+            return self.discovery_interval
+        return self._adaptive_polling.interval(
+            DISCOVERY_KEY, self.discovery_interval, MIN_DISCOVERY_INTERVAL
+        )
+
+    def effective_query_interval(self, dev_id):
+        """The query interval for a device adapted to its change rate"""
+        if self._adaptive_polling is None:
+            return self.query_interval
+        return self._adaptive_polling.interval(
+            dev_id, self.query_interval, MIN_QUERY_INTERVAL
+        )
+
+    def _discovery_allowed_at(self):
+        if not self._last_discovery or self._force_discovery:
+            return datetime.min
+        return self._last_discovery + timedelta(
+            seconds=self.effective_discovery_interval()
+        )
+
+    def _query_allowed_at(self, device):
+        if device._last_query == datetime.min:
+            return datetime.min
+        return device._last_query + timedelta(
+            seconds=self.effective_query_interval(device.object_id())
+        )
+
+    def next_discovery_time(self):
+        """The time after which discovery calls the API instead of using cache"""
+        return max(datetime.now(), self._discovery_allowed_at())
+
+    def next_query_time(self, dev_id):
+        """The time after which a device update can use the query command"""
+        if self._devices.entry(dev_id) is None:
+            return None
+        device = self._devices.get(dev_id, create=False)
+        if device is None:
+            # never updated since it has not been used yet
+            return datetime.now()
+        return max(datetime.now(), self._query_allowed_at(device))
+
+    def throttle_events(self):
+        """The most recent FrequentlyInvoke errors returned by the API"""
+        return list(self._throttle_events)
+
+    def rate_limit_status(self):
+        """Summary of the current discovery and query budget"""
+        now = datetime.now()
+        next_discovery = max(now, self._discovery_allowed_at())
+        queries = {}
+        for dev_id in self._devices.ids():
+            device = self._devices.get(dev_id, create=False)
+            next_query = now
+            if device is not None:
+                next_query = max(now, self._query_allowed_at(device))
+            queries[dev_id] = {
+                "interval": self.effective_query_interval(dev_id),
+                "next_allowed": next_query,
+                "wait": (next_query - now).total_seconds(),
+            }
+        return {
+            "discovery": {
+                "interval": self.effective_discovery_interval(),
+                "next_allowed": next_discovery,
+                "wait": (next_discovery - now).total_seconds(),
+                "fail_count": self._discovery_fail_count,
+            },
+            "query": queries,
+            "queries_allowed": sum(1 for q in queries.values() if not q["wait"]),
+            "throttle_events": self.throttle_events(),
+        }
+
+    def init(
+        self,
+        username,
+        password,
+        countryCode,
+        bizType="",
+        region=DEFAULTREGION,
+        session=None,
+        probe_region=False,
+    ):
+        self._session.username = username
+        self._session.password = password
+        self._session.countryCode = countryCode
+        self._session.bizType = bizType
+        self._session.region = region
+
+        # session can be replaced, e.g. by tuyaha.transport replay session
+        self._requestSession = session or requests.Session()
+        # if region is not known, login is sent to all regions at once
+        self._probe_region = probe_region
 
         if username is None or password is None:
             return None
         else:
             self.get_access_token()
             self.discover_devices()
-            return SESSION.devices
+            return self._session.devices
+
+    def _run_traced(self, hooks, trace, func, *args):
+        try:
+            return func(*args, trace)
+        except Exception as ex:
+            trace.error = ex
+            raise
+        finally:
+            trace_end(hooks, trace)
 
     def get_access_token(self):
+        cache = self._region_cache
+        session = self._session
+        account = (session.username, session.countryCode, session.bizType)
+        cached = cache.get(*account) if cache is not None else None
+        if cached is not None:
+            self._session.region = cached
+        elif self._probe_region:
+            self._probe_access_token()
+            return
+        try:
+            self._set_access_token(self._login(self._session.region))
+        except TuyaAPIException:
+            if cached is None:
+                raise
+            # account moved to another region
+            cache.discard(*account)
+            if not self._probe_region:
+                raise
+            self._probe_access_token()
+            return
+        if cache is not None:
+            cache.set(*account, self._session.region)
+
+    def _probe_access_token(self):
+        # login on all regions concurrently, the first valid answer is used
+        # and the others are ignored when they complete
+        executor = ThreadPoolExecutor(
+            max_workers=len(REGIONS), thread_name_prefix="tuyaha-region"
+        )
+        futures = [executor.submit(self._login, region) for region in REGIONS]
+        errors = []
+        try:
+            for future in as_completed(futures):
+                try:
+                    response_json = future.result()
+                except Exception as ex:
+                    _LOGGER.debug("login failed on region: %s", ex)
+                    errors.append(ex)
+                    continue
+                self._set_access_token(response_json)
+                if self._region_cache is not None:
+                    self._region_cache.set(
+                        self._session.username,
+                        self._session.countryCode,
+                        self._session.bizType,
+                        self._session.region,
+                    )
+                return
+        finally:
+            executor.shutdown(wait=False)
+        for error in errors:
+            # the account exists on this region, report it first
+            if isinstance(error, TuyaAPIRateLimitException):
+                raise error
+        raise errors[0]
+
+    def _login(self, region):
+        hooks = self._trace_hooks
+        if hooks is None:
+            return self._post_auth(region, None)
+        trace = trace_start(hooks, "auth", "auth", None, None)
+        return self._run_traced(hooks, trace, self._post_auth, region)
+
+    def _post_auth(self, region, trace):
         try:
             response = self._requestSession.post(
-                (TUYACLOUDURL + "/homeassistant/auth.do").format(SESSION.region),
+                (TUYACLOUDURL + "/homeassistant/auth.do").format(region),
                 data={
-                    "userName": SESSION.username,
-                    "password": SESSION.password,
-                    "countryCode": SESSION.countryCode,
-                    "bizType": SESSION.bizType,
+                    "userName": self._session.username,
+                    "password": self._session.password,
+                    "countryCode": self._session.countryCode,
+                    "bizType": self._session.bizType,
                     "from": "tuya",
                 },
             )
@@ -118,7 +520,10 @@ class TuyaApi:
             if response.status_code >= 500:
                 raise TuyaServerException from ex
 
-        response_json = response.json()
+        if trace is not None:
+            trace.status = response.status_code
+            trace.response_size = len(response.content)
+        response_json = self._json_codec.loads(response.content)
         if response_json.get("responseStatus") == "error":
             message = response_json.get("errorMsg")
             if message == "error":
@@ -127,84 +532,263 @@ class TuyaApi:
                 raise TuyaAPIRateLimitException("login rate limited")
             else:
                 raise TuyaAPIException(message)
+        return response_json
 
-        SESSION.accessToken = response_json.get("access_token")
-        SESSION.refreshToken = response_json.get("refresh_token")
-        SESSION.expireTime = int(time.time()) + response_json.get("expires_in")
-        areaCode = SESSION.accessToken[0:2]
+    def _set_access_token(self, response_json):
+        self._session.accessToken = response_json.get("access_token")
+        self._session.refreshToken = response_json.get("refresh_token")
+        self._session.expireTime = int(time.time()) + response_json.get("expires_in")
+        areaCode = self._session.accessToken[0:2]
         if areaCode == "AY":
-            SESSION.region = "cn"
+            self._session.region = "cn"
         elif areaCode == "EU":
-            SESSION.region = "eu"
+            self._session.region = "eu"
         else:
-            SESSION.region = "us"
+            self._session.region = "us"
 
     def check_access_token(self):
-        if SESSION.username == "" or SESSION.password == "":
+        session = self._session
+        if session.username == "":
             raise TuyaAPIException("can not find username or password")
-        if SESSION.accessToken == "" or SESSION.refreshToken == "":
-            self.get_access_token()
-            self._force_discovery = True
-        elif SESSION.expireTime <= REFRESHTIME + int(time.time()):
-            self.refresh_access_token()
-            self._force_discovery = True
+        with self._token_lock:
+            if session.accessToken == "" or session.refreshToken == "":
+                # a login needs the password, not kept by a pickled api
+                if session.password == "":
+                    raise TuyaAPIException("can not find username or password")
+                self.get_access_token()
+                self._force_discovery = True
+            elif session.expireTime <= REFRESHTIME + int(time.time()):
+                self.refresh_access_token()
+                self._force_discovery = True
 
     def refresh_access_token(self):
-        data = "grant_type=refresh_token&refresh_token=" + SESSION.refreshToken
+        hooks = self._trace_hooks
+        if hooks is None:
+            return self._refresh_access_token(None)
+        trace = trace_start(hooks, "refresh", "auth", None, None)
+        return self._run_traced(hooks, trace, self._refresh_access_token)
+
+    def _refresh_access_token(self, trace):
+        data = "grant_type=refresh_token&refresh_token=" + self._session.refreshToken
         response = self._requestSession.get(
-            (TUYACLOUDURL + "/homeassistant/access.do").format(SESSION.region)
+            (TUYACLOUDURL + "/homeassistant/access.do").format(self._session.region)
             + "?"
             + data
         )
-        response_json = response.json()
+        if trace is not None:
+            trace.status = response.status_code
+            trace.response_size = len(response.content)
+        response_json = self._json_codec.loads(response.content)
         if response_json.get("responseStatus") == "error":
             raise TuyaAPIException("refresh token failed")
 
-        SESSION.accessToken = response_json.get("access_token")
-        SESSION.refreshToken = response_json.get("refresh_token")
-        SESSION.expireTime = int(time.time()) + response_json.get("expires_in")
+        self._session.accessToken = response_json.get("access_token")
+        self._session.refreshToken = response_json.get("refresh_token")
+        self._session.expireTime = int(time.time()) + response_json.get("expires_in")
 
     def poll_devices_update(self):
         self.check_access_token()
         return self.discover_devices()
 
     def update_device_data(self, dev_id, data):
-        for device in self._discovered_devices:
-            if device["id"] == dev_id:
-                device["data"] = data
+        with self.state_lock:
+            state = self._device_states.get(dev_id)
+            # devices share the state dict, only data of a device created
+            # outside discovery must be copied
+            if state is not None and state is not data:
+                state.update(data)
+        self.state_merged(dev_id)
+        self.notify_state_changed(dev_id)
+
+    def device_state(self, dev_id):
+        """Return the cached data of a device, shared with the device object"""
+        return self._device_states.get(dev_id)
+
+    def add_state_listener(self, listener):
+        """Call listener(dev_id) when the cached state of a device changes.
+
+        dev_id is None when all devices are reloaded by discovery.
+        """
+        self._state_listeners.append(listener)
+
+    def remove_state_listener(self, listener):
+        self._state_listeners.remove(listener)
+
+    # called when data has been merged in the state of a device, its row
+    # of the snapshot columns is read again by the next snapshot
+    def state_merged(self, dev_id):
+        columns = self._state_columns
+        if columns is not None:
+            columns.changed(dev_id)
+
+    def notify_state_changed(self, dev_id):
+        for listener in self._state_listeners:
+            try:
+                listener(dev_id)
+            except Exception:
+                _LOGGER.exception("state listener failed for device %s", dev_id)
+
+    # called with the data returned by a query command before
+    # it is merged in the device cache
+    def notify_device_data(self, dev_id, old_data, data):
+        if self._history is not None:
+            self._history.record(dev_id, data)
+        if self._adaptive_polling is not None:
+            self._adaptive_polling.observe(dev_id, data_changed(old_data, data))
+
+    def force_discovery(self):
+        """Run a real discovery at the next call, whatever the interval"""
+        self._force_discovery = True
 
     def _call_discovery(self):
         if not self._last_discovery or self._force_discovery:
             self._force_discovery = False
             return True
         difference = (datetime.now() - self._last_discovery).total_seconds()
-        if difference > self.discovery_interval:
+        if difference > self.effective_discovery_interval():
             return True
         return False
 
     # if discovery is called before that configured polling interval has passed
     # it return cached data retrieved by previous successful call
     def discovery(self):
-        with lock:
+        devices, reloaded = self._discover()
+        if reloaded:
+            self.notify_state_changed(None)
+        return devices
+
+    async def async_discovery(self):
+        devices, reloaded = await self._async_discover()
+        if reloaded:
+            self.notify_state_changed(None)
+        return devices
+
+    # return the devices and if they have been reloaded, the caller notifies
+    # the state listeners once it does not hold any lock
+    def _discover(self):
+        # acquired in two steps only to report lock contention to trace hooks
+        discovery_lock = self._discovery_lock
+        contended = not discovery_lock.acquire(blocking=False)
+        if contended:
+            discovery_lock.acquire()
+        reloaded = False
+        try:
+            if self._call_discovery():
+                started = datetime.now()
+                try:
+                    response = self._request(
+                        "Discovery", "discovery", lock_contended=contended
+                    )
+                finally:
+                    self._last_discovery = datetime.now()
+                reloaded = self._process_discovery(response, started)
+            else:
+                _LOGGER.debug("Discovery: Use cached info")
+        finally:
+            discovery_lock.release()
+        return self._discovered_devices, reloaded
+
+    async def _async_discover(self):
+        # the discovery lock is not awaited: if discovery is running in
+        # another task or thread, the cached data is returned
+        discovery_lock = self._discovery_lock
+        if not discovery_lock.acquire(blocking=False):
+            _LOGGER.debug("Discovery: running elsewhere, use cached info")
+            return self._discovered_devices, False
+        reloaded = False
+        try:
             if self._call_discovery():
+                started = datetime.now()
                 try:
-                    response = self._request("Discovery", "discovery")
+                    response = await self._async_request("Discovery", "discovery")
                 finally:
                     self._last_discovery = datetime.now()
-                if response:
-                    result_code = response["header"]["code"]
-                    if result_code == "SUCCESS":
-                        self._discovery_fail_count = 0
-                        self._discovered_devices = response["payload"]["devices"]
-                        self._load_session_devices()
+                reloaded = self._process_discovery(response, started)
             else:
                 _LOGGER.debug("Discovery: Use cached info")
-        return self._discovered_devices
+        finally:
+            discovery_lock.release()
+        return self._discovered_devices, reloaded
+
+    # must be called with the discovery lock, return True if devices
+    # have been reloaded
+    def _process_discovery(self, response, started):
+        if not response or response["header"]["code"] != "SUCCESS":
+            return False
+        self._discovery_fail_count = 0
+        with self.state_lock:
+            devices = response["payload"]["devices"]
+            self._keep_newer_updates(devices, started)
+            self._observe_discovery(devices)
+            self._merge_device_states(devices)
+            self._discovered_devices = devices
+            self._load_session_devices()
+        return True
+
+    # values set by commands sent while discovery was running are newer
+    # than the ones returned by discovery, so they are kept
+    def _keep_newer_updates(self, devices, started):
+        for device in devices:
+            old = self._devices.get(device["id"], create=False)
+            if old is not None and old._optimistic_data and device.get("data"):
+                old._keep_newer_updates(device["data"], started)
+
+    def _observe_discovery(self, devices):
+        if self._history is not None:
+            for device in devices:
+                self._history.record(device["id"], device.get("data"))
+        if self._adaptive_polling is None:
+            return
+        old_data = {}
+        if self._discovered_devices:
+            for device in self._discovered_devices:
+                old_data[device["id"]] = device.get("data")
+        any_changed = False
+        for device in devices:
+            dev_id = device["id"]
+            changed = data_changed(old_data.get(dev_id), device.get("data") or {})
+            self._adaptive_polling.observe(dev_id, changed)
+            any_changed = any_changed or changed
+        self._adaptive_polling.observe(DISCOVERY_KEY, any_changed)
+
+    # discovery data is merged in the existing state of each device, so
+    # cache entries and device objects keep sharing a single dict
+    def _merge_device_states(self, devices):
+        states = {}
+        for device in devices:
+            dev_id = device["id"]
+            data = device.get("data") or {}
+            state = self._device_states.get(dev_id)
+            if state is None:
+                state = data
+            elif state is not data:
+                state.update(data)
+            device["data"] = state
+            states[dev_id] = state
+        self._device_states = states
 
+    # device objects are created by the list when they are first used, only
+    # the objects already created are carried over to the new list
     def _load_session_devices(self):
-        SESSION.devices = []
-        for device in self._discovered_devices:
-            SESSION.devices.extend(get_tuya_device(device, self))
+        devices = TuyaDeviceList(self._discovered_devices, self)
+        for old in self._devices.created():
+            entry = devices.entry(old.object_id())
+            if (
+                entry is not None
+                and old.data is entry["data"]
+                and old.device_type() == entry.get("dev_type")
+            ):
+                # device already updated by the state merge, keep it with
+                # the values learned so far (e.g. temperature divider)
+                old.obj_name = entry.get("name")
+                old.obj_type = entry.get("ha_type")
+                old.icon = entry.get("icon")
+                old._invalidate_capabilities()
+                devices.adopt(old)
+        self._session.devices = devices
+        self._devices = devices
+        if self._state_columns is not None:
+            self._state_columns.load(self._discovered_devices)
 
     def discover_devices(self):
         devices = self.discovery()
@@ -213,40 +797,126 @@ class TuyaApi:
         return devices
 
     def get_devices_by_type(self, dev_type):
-        device_list = []
-        for device in SESSION.devices:
-            if device.device_type() == dev_type:
-                device_list.append(device)
-        return device_list
+        return self._devices.of_type(dev_type)
 
     def get_all_devices(self):
-        return SESSION.devices
+        return self._session.devices
+
+    def get_device_ids(self):
+        """Return the ids of all the devices without creating their objects"""
+        return self._devices.ids()
 
     def get_device_by_id(self, dev_id):
-        for device in SESSION.devices:
-            if device.object_id() == dev_id:
-                return device
-        return None
+        return self._devices.get(dev_id)
+
+    def state_snapshot(self, dev_type=None, use_numpy=None):
+        """Return the state of all devices (or of a device type) as columns.
+
+        Built from the cached data, device objects are not created.
+        """
+        with self.state_lock:
+            devices = self._devices
+            if self._state_columns is None:
+                self._state_columns = TuyaStateColumns(self._discovered_devices or ())
+        objects = {device.object_id(): device for device in devices.created()}
+        return self._state_columns.snapshot(objects, use_numpy, dev_type)
 
-    def device_control(self, devId, action, param=None, namespace="control"):
+    def device_control(self, devId, action, param=None, namespace="control", retry=0):
         if param is None:
             param = {}
-        response = self._request(action, namespace, devId, param)
+        response = self._request(action, namespace, devId, param, retry=retry)
         if response and response["header"]["code"] == "SUCCESS":
             success = True
         else:
             success = False
         return success, response
 
-    def _request(self, name, namespace, devId=None, payload={}):
-        header = {"name": name, "namespace": namespace, "payloadVersion": 1}
-        payload["accessToken"] = SESSION.accessToken
+    async def async_device_control(
+        self, devId, action, param=None, namespace="control", retry=0
+    ):
+        if param is None:
+            param = {}
+        response = await self._async_request(
+            action, namespace, devId, param, retry=retry
+        )
+        if response and response["header"]["code"] == "SUCCESS":
+            success = True
+        else:
+            success = False
+        return success, response
+
+    async def async_poll_devices_update(self):
+        import asyncio
+
+        # token is rarely refreshed, the blocking check runs in the executor
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.check_access_token)
+        devices = await self.async_discovery()
+        if not devices:
+            return None
+        return devices
+
+    def _get_async_session(self):
+        # replaced sessions (e.g. replay) are sync only, they run in executor
+        if (
+            _load_aiohttp() is None
+            or type(self._requestSession) is not requests.Session
+        ):
+            return None
+        if self._async_session is None or self._async_session.closed:
+            self._async_session = aiohttp.ClientSession()
+        return self._async_session
+
+    async def async_close(self):
+        """Close the aiohttp session used by the async methods"""
+        if self._async_session is not None:
+            await self._async_session.close()
+            self._async_session = None
+
+    def _build_request(self, name, namespace, devId, payload):
+        # caller payload is copied, so it is never changed by the request
+        payload = dict(payload) if payload else {}
+        payload["accessToken"] = self._session.accessToken
         if namespace != "discovery":
             payload["devId"] = devId
-        data = {"header": header, "payload": payload}
+        return build_request(self._json_codec, name, namespace, payload)
+
+    def _request(
+        self, name, namespace, devId=None, payload=None, lock_contended=False, retry=0
+    ):
+        data = self._build_request(name, namespace, devId, payload)
+        hooks = self._trace_hooks
+        if hooks is None:
+            return self._send_request(name, devId, data, None)
+        trace = trace_start(
+            hooks, name, namespace, devId, len(data), retry, lock_contended
+        )
+        return self._run_traced(hooks, trace, self._send_request, name, devId, data)
+
+    async def _async_request(
+        self, name, namespace, devId=None, payload=None, lock_contended=False, retry=0
+    ):
+        data = self._build_request(name, namespace, devId, payload)
+        hooks = self._trace_hooks
+        if hooks is None:
+            return await self._async_send_request(name, devId, data, None)
+        trace = trace_start(
+            hooks, name, namespace, devId, len(data), retry, lock_contended
+        )
+        try:
+            return await self._async_send_request(name, devId, data, trace)
+        except Exception as ex:
+            trace.error = ex
+            raise
+        finally:
+            trace_end(hooks, trace)
+
+    def _send_request(self, name, devId, data, trace):
         try:
             response = self._requestSession.post(
-                (TUYACLOUDURL + "/homeassistant/skill").format(SESSION.region), json=data
+                (TUYACLOUDURL + "/homeassistant/skill").format(self._session.region),
+                data=data,
+                headers=JSON_HEADERS,
             )
         except RequestsConnectionError as ex:
             _LOGGER.warning(
@@ -254,17 +924,60 @@ class TuyaApi:
                 ex,
                 devId,
             )
+            if trace is not None:
+                trace.error = ex
             return
+        return self._handle_response(
+            name, devId, response.status_code, response.content, trace
+        )
+
+    async def _async_send_request(self, name, devId, data, trace):
+        session = self._get_async_session()
+        if session is None:
+            import asyncio
 
-        if not response.ok:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, self._send_request, name, devId, data, trace
+            )
+        try:
+            async with session.post(
+                (TUYACLOUDURL + "/homeassistant/skill").format(self._session.region),
+                data=data,
+                headers=JSON_HEADERS,
+            ) as response:
+                status = response.status
+                content = await response.read()
+        except aiohttp.ClientError as ex:
             _LOGGER.warning(
-                "request error, status code is %d, device %s",
-                response.status_code,
+                "request error, error code is %s, device %s",
+                ex,
                 devId,
             )
+            if trace is not None:
+                trace.error = ex
             return
-        response_json = response.json()
+        return self._handle_response(name, devId, status, content, trace)
+
+    def _handle_response(self, name, devId, status, content, trace):
+        if trace is not None:
+            trace.status = status
+            trace.response_size = len(content)
+        if status >= 400:
+            _LOGGER.warning(
+                "request error, status code is %d, device %s",
+                status,
+                devId,
+            )
+            # the request reached the cloud, only connection errors are
+            # returned as None so callers can tell them apart
+            return {
+                "header": {"code": "HttpError", "msg": "status code {}".format(status)}
+            }
+        response_json = self._json_codec.loads(content)
         result_code = response_json["header"]["code"]
+        if trace is not None:
+            trace.result_code = result_code
         if result_code != "SUCCESS":
             if result_code == "FrequentlyInvoke":
                 self._raise_frequently_invoke(
@@ -277,24 +990,64 @@ class TuyaApi:
         return response_json
 
     def _raise_frequently_invoke(self, action, error_msg, dev_id):
+        interval = None
         if action == "Discovery":
             self._discovery_fail_count += 1
             text = (
                 "Method [Discovery] fails {} time(s) using poll interval {} - error: {}"
             )
-            message = text.format(
-                self._discovery_fail_count, self.discovery_interval, error_msg
-            )
+            interval = self.effective_discovery_interval()
+            message = text.format(self._discovery_fail_count, interval, error_msg)
         else:
             text = "Method [{}] for device {} fails {}- error: {}"
             msg_interval = ""
             if action == "QueryDevice":
-                msg_interval = "using poll interval {} ".format(self.query_interval)
+                interval = self.effective_query_interval(dev_id)
+                msg_interval = "using poll interval {} ".format(interval)
             message = text.format(action, dev_id, msg_interval, error_msg)
 
+        self._throttle_events.append(
+            TuyaThrottleEvent(datetime.now(), action, dev_id, interval, message)
+        )
+
         raise TuyaFrequentlyInvokeException(message)
 
 
+def _load_aiohttp():
+    global aiohttp, _aiohttp_checked
+    if not _aiohttp_checked:
+        try:
+            import aiohttp as module
+
+            aiohttp = module
+        except ImportError:  # pragma: no cover - optional dependency
+            pass
+        _aiohttp_checked = True
+    return aiohttp
+
+
+def _reset_connection_pools(session):
+    for adapter in session.adapters.values():
+        if isinstance(adapter, HTTPAdapter):
+            adapter.proxy_manager = {}
+            adapter.init_poolmanager(
+                adapter._pool_connections,
+                adapter._pool_maxsize,
+                block=adapter._pool_block,
+            )
+
+
+def _after_fork_in_child():
+    global lock
+    lock = Lock()
+    for api in list(_instances):
+        api._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
 class TuyaAPIException(Exception):
     pass
 